@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+# Times the single-pass PEM parser against the old readlines()/two-scan
+# lookup on synthetic CA bundles.  The base64 payload is random, which is
+# fine because neither approach decodes it.
+#
+#   python benchmarks/bench_pem.py [number of certificates ...]
+
+from tempfile import NamedTemporaryFile
+
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pypki2config.pem import parse_pem_bundle
+
+_now = getattr(time, 'perf_counter', time.time)
+
+def make_bundle(f, count, bag_attributes):
+    for i in range(count):
+        if bag_attributes:
+            f.write(b'Bag Attributes\n    friendlyName: cert ' + str(i).encode('ascii') + b'\nsubject=/CN=ca\nissuer=/CN=ca\n')
+
+        f.write(b'-----BEGIN CERTIFICATE-----\n')
+        payload = base64.b64encode(os.urandom(1200))
+
+        for j in range(0, len(payload), 64):
+            f.write(payload[j:j+64] + b'\n')
+
+        f.write(b'-----END CERTIFICATE-----\n')
+
+def legacy_extract(filename, beginStr, endStr):
+    # the lookup PEMLoader used before the streaming parser, which only finds the first object
+    with open(filename, 'r') as f:
+        lines = list(f.readlines())
+        end = None
+
+        for i, x in enumerate(lines):
+            if endStr in x:
+                end = i
+                break
+
+        if end is not None:
+            for i in range(end, -1, -1):
+                if beginStr in lines[i]:
+                    return ''.join(lines[i:end+1])
+
+    return None
+
+def best_of(func, repeat=5):
+    best = None
+
+    for i in range(repeat):
+        start = _now()
+        func()
+        elapsed = _now() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+def main(counts):
+    print('{0:>8} {1:>6} {2:>10} {3:>16} {4:>14}'.format('certs', 'bags', 'MB', 'legacy key+cert', 'single pass'))
+
+    for count in counts:
+        for bag_attributes in (True, False):
+            f = NamedTemporaryFile(delete=False)
+            make_bundle(f, count, bag_attributes)
+            f.close()
+
+            try:
+                size = os.path.getsize(f.name) / 1048576.0
+                legacy = best_of(lambda: (legacy_extract(f.name, 'Bag Attributes', '-----END ENCRYPTED PRIVATE KEY-----'), legacy_extract(f.name, 'Bag Attributes', '-----END CERTIFICATE-----')))
+                single = best_of(lambda: parse_pem_bundle(f.name))
+                print('{0:>8} {1:>6} {2:>10.1f} {3:>15.1f}ms {4:>13.1f}ms'.format(count, 'yes' if bag_attributes else 'no', size, legacy*1000, single*1000))
+            finally:
+                os.unlink(f.name)
+
+if __name__ == '__main__':
+    main([ int(x) for x in sys.argv[1:] ] or [ 150, 1000, 10000 ])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+# Compares the TLS context profiles against a local mutual-TLS server.  A
+# throwaway CA, server and client certificate are generated, the server runs
+# in a child process (so its CPU time is not counted), and each profile does
+# a run of full handshakes and a run that resumes sessions where the profile
+# allows it (the default profile never does).  The server is
+# run once capped at TLS 1.2 and once allowing TLS 1.3.
+#
+#   python benchmarks/bench_profiles.py [handshakes per run]
+#
+# Loopback has no network latency, so these numbers are client CPU and
+# handshake processing time only.  On a real link each round trip saved by
+# TLS 1.3 or by resumption adds one RTT on top.
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+import datetime
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pypki2config.profiles import PROFILES, apply_profile, new_ssl_context
+
+def _name(cn):
+    return x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, cn) ])
+
+def _write_pair(directory, prefix, cert, key):
+    with open(os.path.join(directory, prefix + '.pem'), 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+def make_certs(directory):
+    now = datetime.datetime.utcnow()
+    ca_key = rsa.generate_private_key(65537, 2048, default_backend())
+    ca = x509.CertificateBuilder().subject_name(_name('bench-ca')).issuer_name(_name('bench-ca')).public_key(ca_key.public_key()) \
+        .serial_number(1).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True).sign(ca_key, hashes.SHA256(), default_backend())
+
+    with open(os.path.join(directory, 'ca.pem'), 'wb') as f:
+        f.write(ca.public_bytes(serialization.Encoding.PEM))
+
+    for serial, cn in ((2, 'localhost'), (3, 'user')):
+        key = rsa.generate_private_key(65537, 2048, default_backend())
+        builder = x509.CertificateBuilder().subject_name(_name(cn)).issuer_name(ca.subject).public_key(key.public_key()) \
+            .serial_number(serial).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+
+        if cn == 'localhost':
+            builder = builder.add_extension(x509.SubjectAlternativeName([ x509.DNSName(u'localhost') ]), critical=False)
+
+        _write_pair(directory, 'server' if cn == 'localhost' else 'client', builder.sign(ca_key, hashes.SHA256(), default_backend()), key)
+
+def serve(directory, max_version, port_file):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(os.path.join(directory, 'server.pem'))
+    ctx.load_verify_locations(os.path.join(directory, 'ca.pem'))
+    ctx.verify_mode = ssl.CERT_REQUIRED
+    ctx.maximum_version = getattr(ssl.TLSVersion, max_version)
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+
+    with open(port_file, 'w') as f:
+        f.write(str(listener.getsockname()[1]))
+
+    while True:
+        conn, addr = listener.accept()
+
+        try:
+            tls = ctx.wrap_socket(conn, server_side=True)
+            tls.recv(1024)
+            tls.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+            tls.close()
+        except (ssl.SSLError, socket.error):
+            conn.close()
+
+def client_context(directory, profile):
+    c = new_ssl_context(ssl.PROTOCOL_SSLv23)
+    c.load_cert_chain(os.path.join(directory, 'client.pem'))
+    c.verify_mode = ssl.CERT_REQUIRED
+    c.load_verify_locations(os.path.join(directory, 'ca.pem'))
+    return apply_profile(c, profile)
+
+def handshakes(c, port, count):
+    elapsed = []
+    reused = 0
+    cpu_start = time.process_time()
+
+    for i in range(count):
+        start = time.perf_counter()
+        tls = c.wrap_socket(socket.create_connection(('127.0.0.1', port)), server_hostname='localhost')
+        elapsed.append(time.perf_counter() - start)
+        reused += tls.session_reused
+        version = tls.version()
+        tls.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+        while tls.recv(1024):
+            pass
+
+        tls.close()
+
+    cpu = time.process_time() - cpu_start
+    return sorted(elapsed)[len(elapsed) // 2], cpu / count, reused / float(count), version
+
+def main(count):
+    directory = tempfile.mkdtemp()
+
+    try:
+        make_certs(directory)
+        print('{0:>8} {1:>12} {2:>8} {3:>9} {4:>12} {5:>11} {6:>12}'.format('server', 'profile', 'version', 'run', 'median ms', 'client CPU', 'resumed'))
+
+        for max_version in ('TLSv1_2', 'TLSv1_3'):
+            port_file = os.path.join(directory, 'port')
+            server = subprocess.Popen([ sys.executable, os.path.abspath(__file__), '--serve', directory, max_version, port_file ])
+
+            try:
+                while not os.path.exists(port_file) or os.path.getsize(port_file) == 0:
+                    time.sleep(0.05)
+
+                with open(port_file) as f:
+                    port = int(f.read())
+
+                for profile in sorted(PROFILES.keys()):
+                    for resume in (False, True):
+                        c = client_context(directory, profile)
+
+                        # without a session cache every handshake is a full one
+                        if not resume:
+                            c.session_cache = None
+
+                        median, cpu, reused, version = handshakes(c, port, count)
+                        print('{0:>8} {1:>12} {2:>8} {3:>9} {4:>12.2f} {5:>9.2f}ms {6:>11.0f}%'.format(max_version, profile, version, 'resumed' if resume else 'full', median * 1000, cpu * 1000, reused * 100))
+            finally:
+                server.kill()
+                server.wait()
+                os.unlink(port_file)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(*sys.argv[2:5])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
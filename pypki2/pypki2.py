@@ -35,10 +35,22 @@ def make_new_httpsconnection_init(loader):
             ctx = kwargs['context']
             protocol = ctx.protocol
 
+        host = args[0] if len(args) > 0 else kwargs.get('host')
+        port = args[1] if len(args) > 1 else kwargs.get('port')
+        host, port = self._get_hostport(host, port)
+        doomed = loader.circuit_error((host, port))
+
         kwargs['key_file'] = None
         kwargs['cert_file'] = None
-        kwargs['context'] = loader.new_context(protocol=protocol)
+
+        if doomed is None:
+            kwargs['context'] = loader.shared_context(protocol=protocol, host=host)
+        else:
+            # connect() will fail fast, so do not spend time decoding the key
+            kwargs['context'] = ssl.SSLContext(protocol)
+
         _orig_HTTPSConnection_init(self, *args, **kwargs)
+        loader.wrap_connection(self, doomed=doomed)
 
     return _new_init
 
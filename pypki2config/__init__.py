@@ -2,6 +2,12 @@
 
 from .config import Loader
 from .exceptions import PyPKI2ConfigException
+from .fetch import FetchRequest, FetchResult
+from .fetch import fetch_all as _fetch_all
+from .pool import ConnectionPool
+from .resolver import parse_host
+
+from threading import Thread
 
 try:
     import ssl
@@ -9,6 +15,7 @@ except ImportError:
     raise PyPKI2ConfigException('Cannot use pypki2.  This instance of Python was not compiled with SSL support.  Try installing openssl-devel and recompiling.')
 
 configured_loader = Loader()
+_configured_pool = None
 
 def dump_key(fobj):
     configured_loader.dump_key(fobj)
@@ -16,5 +23,53 @@ def dump_key(fobj):
 def ca_path():
     return configured_loader.ca_path()
 
-def ssl_context(protocol=ssl.PROTOCOL_SSLv23, password=None):
-    return configured_loader.new_context(protocol=protocol, password=password)
+def ssl_context(protocol=ssl.PROTOCOL_SSLv23, password=None, profile=None, host=None):
+    return configured_loader.new_context(protocol=protocol, password=password, profile=profile, host=host)
+
+def connection_pool():
+    global _configured_pool
+
+    if _configured_pool is None:
+        _configured_pool = ConnectionPool(configured_loader)
+
+    return _configured_pool
+
+def fetch_all(requests, max_per_host=4, max_total=16, password=None):
+    configured_loader.prepare_loader(password=password)
+    return _fetch_all(connection_pool(), requests, max_per_host=max_per_host, max_total=max_total)
+
+def preconnect(hosts=None, count=1, password=None, background=False):
+    # warms DNS, the TLS session and count idle pooled connections for each host (default: "preconnect" in .mypki)
+    configured_loader.prepare_loader(password=password)
+    pool = connection_pool()
+
+    if hosts is None:
+        hosts = configured_loader.preconnect_hosts()
+    else:
+        hosts = [ (h[0].lower(), h[1]) if isinstance(h, (tuple, list)) else parse_host(h) for h in hosts ]
+
+    errors = {}
+
+    def warm(host, port):
+        try:
+            pool.preconnect(host, port, count=count)
+        except Exception as e:
+            errors[(host, port)] = e
+
+            if background:
+                print('Warning: could not pre-connect to {0}:{1}: {2}'.format(host, port, e))
+
+    threads = [ Thread(target=warm, args=key) for key in hosts ]
+
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    if background:
+        # errors fills in as the threads finish
+        return threads, errors
+
+    for t in threads:
+        t.join()
+
+    return errors
@@ -0,0 +1,7 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .diagnostics import main
+
+import sys
+
+sys.exit(main())
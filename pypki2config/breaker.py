@@ -0,0 +1,101 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import CircuitOpenException
+
+from threading import Lock
+
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class HostCircuit(object):
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.retry_at = None
+        self.delay = 0.0
+        self.trial_deadline = None
+        self.last_error = None
+
+class CircuitBreaker(object):
+    '''
+    Remembers which hosts recently failed to connect or complete the mutual
+    TLS handshake.  After `failures` consecutive failures a host's circuit
+    opens and connections to it fail immediately for base_delay seconds,
+    doubling each time it opens again up to max_delay.  Once the delay has
+    passed a single trial connection is let through; success closes the
+    circuit and failure opens it again.  A trial that never reports back is
+    given up on after another delay, and a new one is let through.
+    '''
+    def __init__(self, failures=2, base_delay=2.0, max_delay=300.0, clock=time.time):
+        self.failures = failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.lock = Lock()
+        self.hosts = {}
+
+    def state(self, key):
+        with self.lock:
+            circuit = self.hosts.get(key)
+            return CLOSED if circuit is None else circuit.state
+
+    def check(self, key):
+        # raises without claiming the trial connection, for callers that are not about to connect
+        with self.lock:
+            self._check(key, self.hosts.get(key), False)
+
+    def before_connect(self, key):
+        with self.lock:
+            self._check(key, self.hosts.get(key), True)
+
+    def record_success(self, key):
+        with self.lock:
+            self.hosts.pop(key, None)
+
+    def release(self, key):
+        # the trial connection was abandoned (eg. KeyboardInterrupt), which says nothing about the host
+        with self.lock:
+            circuit = self.hosts.get(key)
+
+            if circuit is not None and circuit.state == HALF_OPEN:
+                circuit.state = OPEN
+                circuit.retry_at = self.clock()
+
+    def record_failure(self, key, error):
+        with self.lock:
+            circuit = self.hosts.setdefault(key, HostCircuit())
+            circuit.failures += 1
+            circuit.last_error = error
+
+            # connections that started before the circuit opened are already covered by its delay
+            if circuit.state == OPEN:
+                return
+
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failures:
+                delay = min(self.max_delay, self.base_delay * (2 ** circuit.opens))
+                circuit.delay = delay
+                circuit.opens += 1
+                circuit.state = OPEN
+                circuit.retry_at = self.clock() + delay
+
+    def _check(self, key, circuit, claim):
+        if circuit is None or circuit.state == CLOSED:
+            return
+
+        now = self.clock()
+
+        if (circuit.state == OPEN and now >= circuit.retry_at) or (circuit.state == HALF_OPEN and now >= circuit.trial_deadline):
+            if claim:
+                circuit.state = HALF_OPEN
+                circuit.trial_deadline = now + circuit.delay
+
+            return
+
+        if circuit.state == OPEN:
+            raise CircuitOpenException('Not connecting to {0}:{1} for another {2:.0f} seconds after repeated failures.  Last error: {3}'.format(key[0], key[1], circuit.retry_at - now, circuit.last_error))
+        else:
+            raise CircuitOpenException('Not connecting to {0}:{1} while a trial connection is in progress.  Last error: {2}'.format(key[0], key[1], circuit.last_error))
@@ -0,0 +1,97 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import PyPKI2ConfigException
+
+import time
+import zlib
+
+_now = getattr(time, 'perf_counter', time.time)
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+def supported(encoding):
+    return encoding is not None and encoding.strip().lower() in _WBITS
+
+class DecodingReader(object):
+    '''
+    Decompresses a gzip or deflate body as it is read.  Compressed input is
+    pulled chunk_size bytes at a time and zlib is never asked for more output
+    than the caller wants, so a small read of a highly compressed body does
+    not inflate the whole thing into memory.
+    '''
+    def __init__(self, raw_read, encoding, stats=None, chunk_size=16384):
+        self.raw_read = raw_read
+        self.encoding = encoding.strip().lower()
+        self.stats = stats
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(_WBITS[self.encoding])
+        self.tail = b''
+        self.started = False
+        self.done = False
+
+    def read(self, amt=None):
+        out = []
+        have = 0
+
+        while not self.done and (amt is None or have < amt):
+            if self.tail:
+                data = self.tail
+            else:
+                data = self.raw_read(self.chunk_size)
+
+                if self.stats is not None:
+                    self.stats.incr('bytes_received', len(data))
+
+            if not data:
+                chunk = self._decompress(self.decompressor.flush)
+                self.done = True
+
+                # an empty body (eg. a HEAD or 204) is fine; zlib only knows where the stream ends on Python 3
+                if self.started and not getattr(self.decompressor, 'eof', True):
+                    raise PyPKI2ConfigException('The {0} response ended before the end of its compressed data.  It was probably truncated.'.format(self.encoding))
+            else:
+                limit = self.chunk_size if amt is None else amt - have
+                chunk = self._decompress(self._inflate, data, limit)
+                self.tail = self.decompressor.unconsumed_tail
+
+                if getattr(self.decompressor, 'eof', False) and not self.tail:
+                    self.done = True
+
+            out.append(chunk)
+            have += len(chunk)
+
+        return b''.join(out)
+
+    def _inflate(self, data, limit):
+        try:
+            chunk = self.decompressor.decompress(data, limit)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            if self.started or self.encoding != 'deflate':
+                raise
+
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            chunk = self.decompressor.decompress(data, limit)
+
+        self.started = True
+        return chunk
+
+    def _decompress(self, func, *args):
+        start = _now()
+
+        try:
+            chunk = func(*args)
+        except zlib.error as e:
+            raise PyPKI2ConfigException('Unable to decompress {0} response: {1}'.format(self.encoding, e))
+
+        if self.stats is not None:
+            self.stats.incr('decompress_seconds', _now() - start)
+            self.stats.incr('bytes_decoded', len(chunk))
+
+        return chunk
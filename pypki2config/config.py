@@ -1,10 +1,16 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
-from .exceptions import PyPKI2ConfigException
+from .breaker import CircuitBreaker
+from .exceptions import CertificateRevokedException, CircuitOpenException, PasswordException, PyPKI2ConfigException
+from .identity import IdentityIndex, pick_identity
 from .p12 import P12Loader
 from .pem import CALoader, PEMLoader
-from .utils import in_ipython, in_nbgallery, input23
+from .profiles import DEFAULT_PROFILE, apply_profile, get_profile
+from .resolver import ResolverCache, parse_host
+from .revocation import RevocationIndex
+from .utils import atomic_write, file_lock, in_ipython, in_nbgallery, input23
 
+from threading import Lock, RLock, current_thread
 from time import sleep
 
 try:
@@ -14,21 +20,66 @@ except ImportError:
 
 import json
 import os
+import sys
+import threading
+
+# warn when the configured identity expires within this many days
+EXPIRY_WARNING_DAYS = 14
+
+def _read_config(filename):
+    try:
+        with open(filename, 'r') as f:
+            j = json.load(f)
+    except ValueError as e:
+        raise PyPKI2ConfigException('Unable to parse your .mypki file at {0}.  Is it in JSON format?'.format(filename))
+
+    return dict(j.items())
+
+def _section_options(value, name):
+    # true means the defaults, false turns the feature off, and an object overrides the defaults
+    if value is True:
+        return {}
+    elif value is False or value is None:
+        return None
+    elif isinstance(value, dict):
+        return value
+    else:
+        raise PyPKI2ConfigException('"{0}" in your .mypki file must be true, false or an object of options.  Got {1!r}'.format(name, value))
+
+def _password_str(password):
+    # loaders keep the password encoded, but configure() wants it as typed
+    if sys.version_info.major == 3 and isinstance(password, bytes):
+        return password.decode('utf-8')
+
+    return password
+
+def _on_main_thread():
+    # threading.main_thread() is Python 3.4+
+    if hasattr(threading, 'main_thread'):
+        return current_thread() is threading.main_thread()
+
+    return current_thread().name == 'MainThread'
+
+def _stat_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return (st.st_mtime, st.st_size, st.st_ino)
 
 class Configuration(object):
     def __init__(self, filename=None):
         self.config = {}
         self.changed = False
+        self.dirty = set()
+        self.filename = filename
+        self.stamp = None
+        self.listeners = []
 
         if filename is not None and os.path.exists(filename):
-            try:
-                with open(filename, 'r') as f:
-                    j = json.load(f)
-            except ValueError as e:
-                raise PyPKI2ConfigException('Unable to parse your .mypki file at {0}.  Is it in JSON format?'.format(filename))
-
-            for k,v in j.items():
-                self.config[k] = v
+            self.stamp = _stat_stamp(filename)
+            self.config = _read_config(filename)
 
     def set(self, k, v):
         if k in self.config and self.config[k] == v:
@@ -36,6 +87,7 @@ class Configuration(object):
         else:
             self.config[k] = v
             self.changed = True
+            self.dirty.add(k)
 
     def get(self, k):
         return self.config.get(k, None)
@@ -43,11 +95,73 @@ class Configuration(object):
     def has(self, k):
         return k in self.config
 
+    def subscribe(self, callback):
+        # callback(configuration, changed_keys) runs whenever the file is seen to change
+        self.listeners.append(callback)
+
+    def refresh(self):
+        # a stat() when nothing changed, and a re-read plus notifications when something did
+        if self.filename is None:
+            return
+
+        stamp = _stat_stamp(self.filename)
+
+        if stamp != self.stamp:
+            self._update(_read_config(self.filename) if stamp is not None else {}, stamp)
+
     def store(self, filename):
         if self.changed:
-            with open(filename, 'w') as f:
-                json.dump(self.config, f)
+            # merge into what is on disk now, so keys written by another kernel are not lost
+            with file_lock(os.path.realpath(filename) + '.lock'):
+                current = _read_config(filename) if os.path.exists(filename) else {}
+
+                for k in self.dirty:
+                    current[k] = self.config[k]
+
+                with atomic_write(filename) as f:
+                    json.dump(current, f)
+
+                stamp = _stat_stamp(filename)
+
+            self.changed = False
+            self.dirty = set()
+
+            if filename == self.filename:
+                self._update(current, stamp)
 
+    def _update(self, new_config, stamp):
+        # unsaved local changes win over what was read from disk
+        for k in self.dirty:
+            new_config[k] = self.config[k]
+
+        keys = set(k for k in set(new_config) | set(self.config) if new_config.get(k) != self.config.get(k))
+        self.config = new_config
+        self.stamp = stamp
+
+        if len(keys) > 0:
+            for callback in list(self.listeners):
+                callback(self, keys)
+
+_configurations = {}
+_configurations_lock = Lock()
+
+def load_configuration(filename):
+    '''
+    Returns the one Configuration for filename shared by the whole process.
+    Later calls only stat() the file, and re-read it if it changed.
+    '''
+    key = os.path.abspath(filename)
+
+    with _configurations_lock:
+        config = _configurations.get(key)
+
+        if config is None:
+            config = Configuration(filename)
+            _configurations[key] = config
+            return config
+
+    config.refresh()
+    return config
 
 def mypki_config_path():
     if 'MYPKI_CONFIG' in os.environ:
@@ -114,9 +228,16 @@ class Loader(object):
         self.config = None
         self.loader = None
         self.ca_loader = None
+        self.revocation = None
+        self.breaker = CircuitBreaker()
+        self.resolver = ResolverCache()
+        self.generation = 0  # bumped whenever the identity or CA is (re)loaded
+        self.contexts = {}
+        self.password = None  # reused when .mypki changes, so a reload on a worker thread never prompts
+        self.lock = RLock()   # held while the identity, CA or shared contexts are (re)built or used
 
     def ipython_config(self):
-        temp_config = Configuration(self.config_path)
+        temp_config = load_configuration(self.config_path)
         if temp_config.has('p12') and 'path' in temp_config.get('p12'):
             pass
         else:
@@ -125,35 +246,191 @@ class Loader(object):
                 display(Javascript("MyPKI.init({'no_verify':true, configure:true});"))
                 print('Configuring .mypki via JavaScript .p12 dialog...')
                 while True:
-                    temp_config = Configuration(self.config_path)
+                    temp_config = load_configuration(self.config_path)
                     if temp_config.has('p12') and 'path' in temp_config.get('p12'):
                         break
                     else:
                         sleep(2)
 
     def prepare_loader(self, password=None):
+        with self.lock:
+            self._prepare_loader(password)
+
+    def _prepare_loader(self, password):
+        if password is not None:
+            self.password = password
+
+        if self.config is None:
+            self.config = load_configuration(self.config_path)
+            self.config.subscribe(self.config_changed)
+        else:
+            self.config.refresh()
+
         if self.loader is None:
-            self.config = Configuration(self.config_path)
             loaders = [ P12Loader(self.config), PEMLoader(self.config) ]
             configured_loaders = [ loader for loader in loaders if loader.is_configured() ]
 
+            if len(configured_loaders) == 0 and self.pick_identity():
+                configured_loaders = [ loader for loader in loaders if loader.is_configured() ]
+
             if len(configured_loaders) == 0:
-                self.loader = pick_loader(loaders)
+                loader = pick_loader(loaders)
             elif len(configured_loaders) > 0:
-                self.loader = configured_loaders[0]
+                loader = configured_loaders[0]
             else:
                 raise PyPKI2ConfigException('No configured PKI loader available.')
 
-            self.loader.configure(password=password)
+            remembered = self.password
+
+            if remembered is None and self.generation > 0 and not _on_main_thread():
+                # .mypki changed under a worker thread, which must not prompt, so only an unencrypted key can load
+                remembered = ''
+
+            # only kept once configured, so a failed password check is retried on the next call
+            try:
+                loader.configure(password=remembered)
+            except PasswordException:
+                # the new identity has a different password than the last one; ask, where asking is safe
+                if password is not None or remembered is None or not _on_main_thread():
+                    raise
+
+                loader.configure()
+
+            self.loader = loader
 
+            if loader.password:
+                self.password = _password_str(loader.password)
+
+            self.ca_loader = None
+            self.generation += 1
+            self.check_expiry()
+
+        if self.ca_loader is None:
             self.ca_loader = CALoader(self.config)
             self.ca_loader.configure()
-
+            self.generation += 1
             self.config.store(self.config_path)
+            self.configure_breaker()
+            self.configure_resolver()
+
+    def config_changed(self, config, keys):
+        # another kernel, or the nbgallery dialog, edited .mypki while this loader was running
+        if 'p12' in keys or 'pem' in keys:
+            self.loader = None
+
+        if 'ca' in keys:
+            self.ca_loader = None
+
+        if 'crl' in keys:
+            # connections already holding the old index keep using it; its map closes when the last one lets go
+            with self.lock:
+                self.revocation = None
+
+        if 'circuit_breaker' in keys:
+            self.configure_breaker()
+
+        if 'dns_cache' in keys:
+            self.configure_resolver()
+
+        if 'tls' in keys:
+            self.contexts = {}
+
+    def configure_breaker(self):
+        # "circuit_breaker": false turns it off, true keeps the defaults, or a dict overrides them
+        if self.config.has('circuit_breaker'):
+            opts = _section_options(self.config.get('circuit_breaker'), 'circuit_breaker')
+
+            if opts is not None:
+                self.breaker = CircuitBreaker(failures=opts.get('failures', 2), base_delay=opts.get('base_delay', 2.0), max_delay=opts.get('max_delay', 300.0))
+            else:
+                self.breaker = None
+
+    def configure_resolver(self):
+        # "dns_cache": false turns it off, true keeps the defaults, or eg. { "ttl": 300 } keeps addresses for longer
+        if self.config.has('dns_cache'):
+            opts = _section_options(self.config.get('dns_cache'), 'dns_cache')
+
+            if opts is not None:
+                self.resolver = ResolverCache(ttl=opts.get('ttl', 60.0), max_entries=opts.get('max_entries', 256))
+            else:
+                self.resolver = None
+
+    def preconnect_hosts(self):
+        # "preconnect": [ "service.example", "other.example:8443" ] in .mypki
+        if self.config is None or not self.config.has('preconnect'):
+            return []
 
-    def new_context(self, protocol=ssl.PROTOCOL_SSLv23, password=None):
-        self.prepare_loader(password=password)
-        c = self.loader.new_context(protocol=protocol)
+        return [ parse_host(h) for h in self.config.get('preconnect') ]
+
+    def identity_index(self):
+        if self.config.has('cert_dir'):
+            return IdentityIndex(self.config.get('cert_dir'))
+
+        return None
+
+    def pick_identity(self):
+        # with a cert_dir in .mypki, offer the indexed identities instead of asking for a path
+        index = self.identity_index()
+
+        if index is None:
+            return False
+
+        identities = index.refresh().valid()
+
+        if len(identities) == 0:
+            return False
+
+        identity = pick_identity(identities)
+        self.config.set(identity.format, { 'path': identity.path })
+        return True
+
+    def check_expiry(self):
+        index = self.identity_index()
+
+        if index is None:
+            return
+
+        # fills in details of an encrypted .p12 the first time its password is known
+        index.refresh(password=self.loader.password, path=self.loader.filename)
+
+        # a relative cert_dir, a trailing slash or a symlink must not hide the warning
+        filename = os.path.realpath(self.loader.filename)
+
+        for identity in index.find():
+            if os.path.realpath(identity.path) == filename and identity.expires_within(EXPIRY_WARNING_DAYS):
+                print('Warning: your PKI certificate {0} expires {1}.'.format(identity.path, identity.not_after))
+
+    def new_context(self, protocol=ssl.PROTOCOL_SSLv23, password=None, profile=None, host=None):
+        with self.lock:
+            self.prepare_loader(password=password)
+            c = self.loader.new_context(protocol=protocol)
+            self.load_ca(c)
+            apply_profile(c, profile or self.profile_for(host))
+            return c
+
+    def shared_context(self, protocol=ssl.PROTOCOL_SSLv23, host=None):
+        # one context per protocol and profile, reused until the identity or CA changes, so the
+        # key is not decoded for every connection and TLS sessions can be resumed
+        with self.lock:
+            self.prepare_loader()
+            key = (protocol, self.profile_for(host))
+            generation, c = self.contexts.get(key, (None, None))
+
+            if generation != self.generation:
+                c = self.new_context(protocol=protocol, profile=key[1])
+                self.contexts[key] = (self.generation, c)
+
+            return c
+
+    def profile_for(self, host=None):
+        # "tls": { "profile": "fast-modern", "hosts": { "old.server": "compat" } } in .mypki
+        tls = self.config.get('tls') or {}
+        hosts = dict((h.lower(), n) for h, n in (tls.get('hosts') or {}).items())
+        name = hosts.get(host.lower() if host else host, tls.get('profile', DEFAULT_PROFILE))
+        get_profile(name)
+        return name
+
+    def load_ca(self, c):
         c.verify_mode = ssl.CERT_REQUIRED
         ca_filename = self.ca_loader.filename.strip()
 
@@ -166,10 +443,102 @@ class Loader(object):
 
         return c
 
+    def revocation_index(self):
+        # only built when .mypki lists CRLs, eg. "crl": { "paths": [ "/path/to/crls" ] }
+        index = self.revocation
+
+        if index is not None or self.config is None or not self.config.has('crl'):
+            return index
+
+        # built under the lock so concurrent first connections share one index instead of each mapping their own
+        with self.lock:
+            if self.revocation is None:
+                crl = self.config.get('crl')
+                cache_dir = crl.get('cache', os.path.join(os.path.dirname(self.config_path), '.pypki2_crl'))
+                self.revocation = RevocationIndex(crl['paths'], cache_dir).refresh()
+
+            return self.revocation
+
+    def circuit_error(self, key):
+        # the error a connection to key would fail fast with, or None if it may be attempted
+        if self.breaker is not None:
+            try:
+                self.breaker.check(key)
+            except CircuitOpenException as e:
+                return e
+
+        return None
+
+    def wrap_connection(self, conn, doomed=None):
+        # installs the resolver cache, circuit breaker and post-handshake checks on an HTTPSConnection, once
+        if getattr(conn, '_pypki2_wrapped', False):
+            return conn
+
+        conn._pypki2_wrapped = True
+        key = (conn.host, conn.port)
+        breaker = self.breaker
+        index = self.revocation_index()
+        connect = conn.connect
+
+        # Python 3 connections look up the host through _create_connection, so they can use cached addresses
+        if self.resolver is not None and hasattr(conn, '_create_connection'):
+            conn._create_connection = self.resolver.create_connection
+
+        def checked_connect():
+            if doomed is not None:
+                raise doomed
+
+            if breaker is not None:
+                breaker.before_connect(key)
+
+            try:
+                connect()
+            except Exception as e:
+                conn.close()
+
+                if breaker is not None:
+                    breaker.record_failure(key, e)
+
+                raise
+            except BaseException:
+                conn.close()
+
+                if breaker is not None:
+                    breaker.release(key)
+
+                raise
+
+            if index is not None:
+                try:
+                    index.check_socket(conn.sock)
+                except CertificateRevokedException as e:
+                    conn.close()
+
+                    if breaker is not None:
+                        breaker.record_failure(key, e)
+
+                    raise
+                except BaseException:
+                    # an unreadable CRL is a problem here, not with the host
+                    conn.close()
+
+                    if breaker is not None:
+                        breaker.release(key)
+
+                    raise
+
+            if breaker is not None:
+                breaker.record_success(key)
+
+        conn.connect = checked_connect
+        return conn
+
     def dump_key(self, fobj):
-        self.prepare_loader()
-        self.loader.dump_key(fobj)
+        with self.lock:
+            self.prepare_loader()
+            self.loader.dump_key(fobj)
 
     def ca_path(self):
-        self.prepare_loader()
-        return self.ca_loader.filename
+        with self.lock:
+            self.prepare_loader()
+            return self.ca_loader.filename
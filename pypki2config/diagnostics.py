@@ -0,0 +1,281 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .config import load_configuration
+from .exceptions import PasswordException, PyPKI2ConfigException
+from .fetch import fetch_all
+from .pem import CALoader
+from .pool import ConnectionPool, split_url
+from .profiles import apply_profile
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+try:
+    import ssl
+except ImportError:
+    raise PyPKI2ConfigException('Cannot use pypki2.  This instance of Python was not compiled with SSL support.  Try installing openssl-devel and recompiling.')
+
+_now = getattr(time, 'perf_counter', time.time)
+
+SETUP_PHASES = ('config_load', 'key_decode', 'context_build', 'ca_load')
+REQUEST_PHASES = ('tcp_connect', 'tls_handshake', 'first_byte', 'total')
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+
+    ordered = sorted(values)
+    k = int(round((len(ordered) - 1) * p / 100.0))
+    return ordered[k]
+
+def summarize(samples, phases):
+    summary = {}
+
+    for phase in phases:
+        values = [ s[phase] for s in samples if s.get(phase) is not None ]
+        summary[phase] = {
+            'min': min(values) if values else None,
+            'median': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': max(values) if values else None,
+        }
+
+    return summary
+
+def require_configured(loader):
+    # without --prompt anything that would ask a question is an error, so the CLI can run from scripts
+    config = load_configuration(loader.config_path)
+
+    if not any(config.has(k) and 'path' in (config.get(k) or {}) for k in ('p12', 'pem')):
+        raise PyPKI2ConfigException('No .p12 or .pem identity is configured in {0}.  Configure pypki2 interactively first, or run with --prompt.'.format(loader.config_path))
+
+    if not CALoader(config).is_configured():
+        raise PyPKI2ConfigException('No existing Certificate Authority (CA) file is configured in {0}.  Configure pypki2 interactively first, or run with --prompt.'.format(loader.config_path))
+
+def measure_setup(loader, password=None, profile=None, host=None, prompt=True):
+    timings = {}
+
+    if not prompt:
+        require_configured(loader)
+
+    # config read, identity and CA lookup, and the password check
+    start = _now()
+
+    try:
+        loader.prepare_loader(password=password if prompt or password is not None else '')
+    except PasswordException:
+        if not prompt and password is None:
+            raise PasswordException('Your PKI key needs a password.  Put it in the environment variable named by --password-env, or run with --prompt.')
+
+        raise
+
+    timings['config_load'] = _now() - start
+
+    start = _now()
+    key = loader.loader.load_key()
+    timings['key_decode'] = _now() - start
+
+    start = _now()
+    ctx = loader.loader.new_context(key=key)
+    apply_profile(ctx, profile or loader.profile_for(host))
+    timings['context_build'] = _now() - start
+
+    start = _now()
+    loader.load_ca(ctx)
+    timings['ca_load'] = _now() - start
+
+    return ctx, timings
+
+def measure_request(ctx, host, port, path, timeout=None, session=None):
+    sample = {}
+    start = _now()
+
+    sock = socket.create_connection((host, port), timeout)
+    connected = _now()
+    sample['tcp_connect'] = connected - start
+
+    try:
+        if session is not None and sys.version_info >= (3, 6):
+            tls = ctx.wrap_socket(sock, server_hostname=host, session=session)
+        else:
+            tls = ctx.wrap_socket(sock, server_hostname=host)
+    except Exception:
+        sock.close()
+        raise
+
+    try:
+        handshaken = _now()
+        sample['tls_handshake'] = handshaken - connected
+        sample['session_reused'] = getattr(tls, 'session_reused', False)
+        sample['protocol'] = tls.version() if hasattr(tls, 'version') else None
+        sample['cipher'] = tls.cipher()[0]
+
+        tls.sendall('GET {0} HTTP/1.1\r\nHost: {1}\r\nConnection: close\r\n\r\n'.format(path, host).encode('ascii'))
+        tls.recv(1)
+        sample['first_byte'] = _now() - handshaken
+
+        while tls.recv(65536):
+            pass
+
+        sample['total'] = _now() - start
+        new_session = getattr(tls, 'session', None)
+    finally:
+        tls.close()
+
+    return sample, new_session
+
+def run_sequential(ctx, url, count, timeout=None, resume=True):
+    host, port, path = split_url(url)
+    samples = []
+    session = None
+
+    # sessions are handed over here, so a profile's session cache must not offer one behind --no-resume's back
+    if getattr(ctx, 'session_cache', None) is not None:
+        ctx.session_cache = None
+
+    for i in range(count):
+        try:
+            sample, new_session = measure_request(ctx, host, port, path, timeout=timeout, session=session)
+        except (socket.error, ssl.SSLError) as e:
+            # one refused or reset connection is part of the picture, not a reason to stop measuring
+            sample, new_session = { 'error': str(e) or e.__class__.__name__ }, None
+
+        samples.append(sample)
+
+        if resume:
+            session = new_session
+
+    return samples
+
+def summarize_sequential(samples):
+    done = [ s for s in samples if 'error' not in s ]
+    errors = [ s['error'] for s in samples if 'error' in s ]
+
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'error': errors[-1] if errors else None,
+        'phases': summarize(done, REQUEST_PHASES),
+        'session_resumption_rate': sum(1 for s in done if s['session_reused']) / float(len(done)) if done else None,
+        'protocol': done[-1]['protocol'] if done else None,
+        'cipher': done[-1]['cipher'] if done else None,
+    }
+
+def run_concurrent(loader, url, count, concurrency, timeout=None):
+    pool = ConnectionPool(loader, max_idle_per_host=concurrency, timeout=timeout)
+    start = _now()
+
+    try:
+        results = list(fetch_all(pool, [ url ] * count, max_per_host=concurrency, max_total=concurrency))
+    finally:
+        pool.close()
+
+    elapsed = _now() - start
+    stats = pool.stats.snapshot()
+    connections = stats['connections_created'] + stats['connections_reused']
+
+    return {
+        'requests': count,
+        'errors': sum(1 for r in results if not r.ok),
+        'elapsed': elapsed,
+        'requests_per_second': count / elapsed if elapsed > 0 else None,
+        'latency': summarize([ { 'total': r.elapsed } for r in results ], ('total',))['total'],
+        'connection_reuse_rate': stats['connections_reused'] / float(connections) if connections else None,
+        'pool': stats,
+    }
+
+def run(loader, url, count=10, concurrency=0, password=None, timeout=None, resume=True, profile=None, prompt=True):
+    host, port, path = split_url(url)
+    ctx, setup = measure_setup(loader, password=password, profile=profile, host=host, prompt=prompt)
+    samples = run_sequential(ctx, url, count, timeout=timeout, resume=resume)
+    report = {
+        'url': url,
+        'profile': profile or loader.profile_for(host),
+        'setup': setup,
+        'sequential': summarize_sequential(samples),
+    }
+
+    if concurrency > 0:
+        report['concurrent'] = run_concurrent(loader, url, count, concurrency, timeout=timeout)
+
+    return report
+
+def _ms(value):
+    return '-' if value is None else '{0:.1f}'.format(value * 1000)
+
+def _rate(value):
+    return '-' if value is None else '{0:.0f}%'.format(value * 100)
+
+def format_table(report):
+    lines = [ 'pypki2 diagnostics for {0} with the {1} TLS profile'.format(report['url'], report.get('profile', 'default')), '' ]
+    lines.append('{0:<16} {1:>10}'.format('setup phase', 'ms'))
+
+    for phase in SETUP_PHASES:
+        lines.append('{0:<16} {1:>10}'.format(phase, _ms(report['setup'][phase])))
+
+    seq = report['sequential']
+    lines.append('')
+    lines.append('{0} sequential requests ({1}, {2})'.format(seq['requests'], seq['protocol'], seq['cipher']))
+    lines.append('{0:<16} {1:>10} {2:>10} {3:>10} {4:>10}'.format('request phase', 'min ms', 'median ms', 'p95 ms', 'max ms'))
+
+    for phase in REQUEST_PHASES:
+        p = seq['phases'][phase]
+        lines.append('{0:<16} {1:>10} {2:>10} {3:>10} {4:>10}'.format(phase, _ms(p['min']), _ms(p['median']), _ms(p['p95']), _ms(p['max'])))
+
+    lines.append('session resumption rate: {0}'.format(_rate(seq['session_resumption_rate'])))
+
+    if seq.get('errors'):
+        lines.append('{0} of {1} requests failed, most recently with: {2}'.format(seq['errors'], seq['requests'], seq['error']))
+
+    if 'concurrent' in report:
+        con = report['concurrent']
+        lat = con['latency']
+        lines.append('')
+        lines.append('{0} pooled requests: {1} errors, {2:.1f} requests/s'.format(con['requests'], con['errors'], con['requests_per_second'] or 0))
+        lines.append('latency ms: min {0}, median {1}, p95 {2}, max {3}'.format(_ms(lat['min']), _ms(lat['median']), _ms(lat['p95']), _ms(lat['max'])))
+        lines.append('connection reuse rate: {0}'.format(_rate(con['connection_reuse_rate'])))
+
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pypki2config', description='Time each phase of PKI requests made with your .mypki identity.')
+    parser.add_argument('url', help='https URL to request')
+    parser.add_argument('-n', '--requests', type=int, default=10, help='number of sequential requests (default 10)')
+    parser.add_argument('-c', '--concurrency', type=int, default=0, help='also run the same number of requests through the connection pool with this many in flight')
+    parser.add_argument('--timeout', type=float, default=None, help='socket timeout in seconds')
+    parser.add_argument('--password-env', default='PYPKI2_PASSWORD', help='environment variable holding the PKI password (default PYPKI2_PASSWORD)')
+    parser.add_argument('--profile', default=None, help='TLS profile for the sequential requests (default from .mypki)')
+    parser.add_argument('--prompt', action='store_true', help='ask for a missing password or .mypki setting instead of failing')
+    parser.add_argument('--no-resume', action='store_true', help='do not offer the previous TLS session on sequential requests')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    from . import configured_loader
+
+    password = os.environ.get(args.password_env)
+
+    try:
+        report = run(configured_loader, args.url, count=args.requests, concurrency=args.concurrency, password=password, timeout=args.timeout, resume=not args.no_resume, profile=args.profile, prompt=args.prompt)
+    except PyPKI2ConfigException as e:
+        sys.stderr.write('{0}\n'.format(e))
+        return 2
+    except (socket.error, ssl.SSLError) as e:
+        sys.stderr.write('Unable to reach {0}: {1}\n'.format(args.url, e))
+        return 1
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_table(report))
+
+    seq = report['sequential']
+
+    if seq['requests'] > 0 and seq['errors'] == seq['requests']:
+        sys.stderr.write('Every request to {0} failed.  Last error: {1}\n'.format(args.url, seq['error']))
+        return 1
+
+    return 0
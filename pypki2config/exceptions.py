@@ -1,4 +1,16 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+import socket
+
 class PyPKI2ConfigException(Exception):
     pass
+
+class PasswordException(PyPKI2ConfigException):
+    pass
+
+class CertificateRevokedException(PyPKI2ConfigException):
+    pass
+
+class CircuitOpenException(PyPKI2ConfigException, socket.error):
+    # a socket.error so urllib reports it as a URLError like any other failed connection
+    pass
@@ -0,0 +1,200 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import PyPKI2ConfigException
+from .pool import split_url
+
+from collections import deque
+from threading import Thread
+
+import sys
+import time
+
+if sys.version_info.major == 3:
+    from queue import Queue
+    _string_types = (str,)
+elif sys.version_info.major == 2:
+    from Queue import Queue
+    _string_types = (str, unicode)
+else:
+    raise PyPKI2ConfigException('Version {0}.{1} is an unknown version of Python.'.format(sys.version_info.major, sys.version_info.minor))
+
+_now = getattr(time, 'perf_counter', time.time)
+
+# responses that mean the server wants us to back off
+THROTTLE_STATUSES = (429, 503)
+
+class FetchRequest(object):
+    def __init__(self, url, method='GET', body=None, headers=None, retry=None):
+        self.url = url
+        self.method = method
+        self.body = body
+        self.headers = headers or {}
+        self.retry = retry  # resend after a stale pooled connection; defaults to idempotent methods only
+
+class FetchResult(object):
+    def __init__(self, request, status=None, reason=None, headers=None, data=None, error=None, elapsed=0.0, reused=False):
+        self.request = request
+        self.status = status
+        self.reason = reason
+        self.headers = headers or []
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+        self.reused = reused
+
+    @property
+    def ok(self):
+        return self.error is None and self.status is not None and 200 <= self.status < 400
+
+class HostLimiter(object):
+    '''
+    Per-host concurrency limit.  Starts at one request and grows by one per
+    success until the host shows congestion (a latency spike, a throttling
+    status or a connection error), then halves and only grows by roughly one
+    request per full window after that.  A spike is the recent latency
+    running past tolerance times a slowly moving baseline, so the baseline
+    follows a host whose normal latency changes instead of remembering its
+    single fastest response.
+    '''
+    def __init__(self, maximum, tolerance=2.0, smoothing=0.3, baseline_smoothing=0.05):
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.limit = 1.0
+        self.latency = None
+        self.baseline = None
+        self.congested = False
+
+    @property
+    def current(self):
+        return max(1, min(self.maximum, int(self.limit)))
+
+    def record(self, status, elapsed, error=None, reused=True):
+        if error is not None or status in THROTTLE_STATUSES:
+            self._back_off()
+            return
+
+        # a new connection's time includes the TCP connect and mutual TLS handshake, which says
+        # nothing about how loaded the server is
+        if not reused:
+            self._grow()
+            return
+
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = self.smoothing * elapsed + (1.0 - self.smoothing) * self.latency
+
+        if self.baseline is None:
+            self.baseline = elapsed
+
+        spike = self.latency > self.baseline * self.tolerance
+        self.baseline = self.baseline_smoothing * elapsed + (1.0 - self.baseline_smoothing) * self.baseline
+
+        if spike:
+            self._back_off()
+        else:
+            self._grow()
+
+    def _grow(self):
+        if self.congested:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        else:
+            self.limit = min(float(self.maximum), self.limit + 1.0)
+
+    def _back_off(self):
+        self.congested = True
+        self.limit = max(1.0, self.limit / 2.0)
+
+        # forget the smoothed latency so one slow stretch does not keep halving the limit
+        self.latency = None
+
+def _as_request(r):
+    if isinstance(r, FetchRequest):
+        return r
+    elif isinstance(r, _string_types):
+        return FetchRequest(r)
+    else:
+        raise PyPKI2ConfigException('Cannot fetch {0!r}.  Pass a URL string or a FetchRequest.'.format(r))
+
+def _worker(pool, tasks, results):
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            break
+
+        key, req = task
+        start = _now()
+
+        try:
+            resp = pool.request(req.method, req.url, body=req.body, headers=req.headers, retry=req.retry)
+
+            try:
+                data = resp.read()
+            finally:
+                resp.close()
+
+            result = FetchResult(req, status=resp.status, reason=resp.reason, headers=resp.getheaders(), data=data, elapsed=_now()-start, reused=getattr(resp, 'reused', True))
+        except Exception as e:
+            result = FetchResult(req, error=e, elapsed=_now()-start)
+
+        results.put((key, result))
+
+def fetch_all(pool, requests, max_per_host=4, max_total=16):
+    if max_per_host < 1 or max_total < 1:
+        raise PyPKI2ConfigException('max_per_host and max_total must be at least 1.')
+
+    pending = {}
+    order = []
+    remaining = 0
+
+    for r in requests:
+        req = _as_request(r)
+        host, port, path = split_url(req.url)
+        key = (host, port)
+
+        if key not in pending:
+            pending[key] = deque()
+            order.append(key)
+
+        pending[key].append(req)
+        remaining += 1
+
+    if remaining == 0:
+        return
+
+    # build the shared context here so any password prompt happens on the caller's thread
+    pool.context()
+
+    limiters = { key:HostLimiter(max_per_host) for key in order }
+    in_flight = { key:0 for key in order }
+    total_in_flight = 0
+
+    tasks = Queue()
+    results = Queue()
+    workers = [ Thread(target=_worker, args=(pool, tasks, results)) for i in range(min(max_total, remaining)) ]
+
+    for w in workers:
+        w.daemon = True
+        w.start()
+
+    try:
+        while remaining > 0:
+            # hand out work round-robin so one busy host cannot starve the rest
+            for key in order:
+                while pending[key] and in_flight[key] < limiters[key].current and total_in_flight < max_total:
+                    tasks.put((key, pending[key].popleft()))
+                    in_flight[key] += 1
+                    total_in_flight += 1
+
+            key, result = results.get()
+            in_flight[key] -= 1
+            total_in_flight -= 1
+            remaining -= 1
+            limiters[key].record(result.status, result.elapsed, error=result.error, reused=result.reused)
+            yield result
+    finally:
+        for w in workers:
+            tasks.put(None)
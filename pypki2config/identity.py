@@ -0,0 +1,249 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import PyPKI2ConfigException
+from .pem import parse_pem_bundle
+from .utils import input23
+
+from datetime import datetime, timedelta
+
+import json
+import os
+
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+import OpenSSL.crypto
+
+INDEX_VERSION = 1
+INDEX_NAME = '.pypki2_index.json'
+IDENTITY_EXTENSIONS = ('.p12', '.pfx', '.pem')
+
+_KEY_TYPES = {
+    OpenSSL.crypto.TYPE_RSA: 'RSA',
+    OpenSSL.crypto.TYPE_DSA: 'DSA',
+    getattr(OpenSSL.crypto, 'TYPE_EC', 408): 'EC',
+}
+
+_TIME_FORMAT = '%Y%m%d%H%M%SZ'
+
+def _name_str(name):
+    return ''.join('/{0}={1}'.format(k.decode('utf-8'), v.decode('utf-8')) for k,v in name.get_components())
+
+def _time_str(asn1_time):
+    return asn1_time.decode('ascii') if asn1_time is not None else None
+
+def _cert_details(cert):
+    pkey = cert.get_pubkey()
+
+    return {
+        'subject': _name_str(cert.get_subject()),
+        'issuer': _name_str(cert.get_issuer()),
+        'fingerprint': cert.digest('sha256').decode('ascii'),
+        'not_before': _time_str(cert.get_notBefore()),
+        'not_after': _time_str(cert.get_notAfter()),
+        'key_type': _KEY_TYPES.get(pkey.type(), str(pkey.type())),
+        'key_bits': pkey.bits(),
+    }
+
+def _blank_details():
+    return dict.fromkeys(['subject', 'issuer', 'fingerprint', 'not_before', 'not_after', 'key_type', 'key_bits'])
+
+def _p12_certificate(data, password):
+    # pyOpenSSL dropped load_pkcs12, so read the bundle with cryptography; ValueError means a wrong password
+    if password is not None and not isinstance(password, bytes):
+        password = password.encode('utf-8')
+
+    key, cert, extra = pkcs12.load_key_and_certificates(data, password, default_backend())
+    return cert
+
+def _scan_p12(filename, password):
+    entry = { 'format': 'p12', 'has_key': True }
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    try:
+        cert = _p12_certificate(data, None)
+        entry['encrypted'] = False
+    except ValueError:
+        entry['encrypted'] = True
+        cert = None
+
+        if password is not None:
+            try:
+                cert = _p12_certificate(data, password)
+            except ValueError:
+                pass
+
+    if cert is not None:
+        entry.update(_cert_details(OpenSSL.crypto.X509.from_cryptography(cert)))
+    else:
+        entry.update(_blank_details())
+
+    return entry
+
+def _scan_pem(filename):
+    objects = parse_pem_bundle(filename)
+    keys = [ o for o in objects if o.is_key ]
+    certs = [ o for o in objects if o.is_certificate ]
+    entry = { 'format': 'pem', 'has_key': len(keys) > 0, 'encrypted': any(o.is_encrypted for o in keys) }
+
+    if len(certs) > 0:
+        entry.update(_cert_details(OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, certs[0].data)))
+    else:
+        entry.update(_blank_details())
+
+    return entry
+
+class Identity(object):
+    def __init__(self, path, entry):
+        self.path = path
+        self.format = entry['format']
+        self.subject = entry['subject']
+        self.issuer = entry['issuer']
+        self.fingerprint = entry['fingerprint']
+        self.not_before = entry['not_before']
+        self.not_after = entry['not_after']
+        self.key_type = entry['key_type']
+        self.key_bits = entry['key_bits']
+        self.encrypted = entry['encrypted']
+
+    @property
+    def known(self):
+        # encrypted .p12 files hide their certificate until a password is given
+        return self.not_after is not None
+
+    def is_valid(self, now=None):
+        if not self.known:
+            return True
+
+        now = now or datetime.utcnow()
+        return datetime.strptime(self.not_before, _TIME_FORMAT) <= now <= datetime.strptime(self.not_after, _TIME_FORMAT)
+
+    def expires_within(self, days, now=None):
+        if not self.known:
+            return False
+
+        now = now or datetime.utcnow()
+        return datetime.strptime(self.not_after, _TIME_FORMAT) <= now + timedelta(days=days)
+
+    def describe(self):
+        if self.known:
+            return '{0} ({1}, expires {2})'.format(self.subject, os.path.basename(self.path), datetime.strptime(self.not_after, _TIME_FORMAT).strftime('%Y-%m-%d'))
+        else:
+            return '{0} (encrypted, details available after first use)'.format(os.path.basename(self.path))
+
+class IdentityIndex(object):
+    '''
+    Remembers what is inside every .p12/.pem file in a directory so picking an
+    identity or checking expiry does not mean decoding each file again.  An
+    entry is only rebuilt when its file's mtime or size changes.
+    '''
+    def __init__(self, directory, index_path=None):
+        self.directory = directory
+        self.index_path = index_path or os.path.join(directory, INDEX_NAME)
+        self.entries = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    j = json.load(f)
+            except ValueError:
+                j = {}
+
+            if j.get('version') == INDEX_VERSION:
+                self.entries = j.get('entries', {})
+
+    def store(self):
+        if self.changed:
+            try:
+                with open(self.index_path, 'w') as f:
+                    json.dump({ 'version': INDEX_VERSION, 'entries': self.entries }, f)
+                self.changed = False
+            except (IOError, OSError):
+                # a read-only certificate directory just means no persistent index
+                pass
+
+    def refresh(self, password=None, path=None):
+        # password opens the encrypted .p12 at path, the identity it belongs to, rather than being tried on every file
+        if not os.path.isdir(self.directory):
+            raise PyPKI2ConfigException('Certificate directory {0} does not exist.'.format(self.directory))
+
+        seen = set()
+        unlocks = None if path is None else os.path.realpath(path)
+
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+
+            if os.path.splitext(name)[1].lower() not in IDENTITY_EXTENSIONS or not os.path.isfile(path):
+                continue
+
+            seen.add(path)
+            st = os.stat(path)
+            entry = self.entries.get(path)
+            file_password = password if unlocks is None or os.path.realpath(path) == unlocks else None
+
+            if entry is not None and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+                if not (file_password is not None and entry['encrypted'] and entry['not_after'] is None):
+                    continue
+
+            self.entries[path] = self._scan(path, file_password)
+            self.entries[path]['mtime'] = st.st_mtime
+            self.entries[path]['size'] = st.st_size
+            self.changed = True
+
+        for path in list(self.entries.keys()):
+            if path not in seen:
+                del self.entries[path]
+                self.changed = True
+
+        self.store()
+        return self
+
+    def identities(self):
+        # files holding a key and a certificate, or a .p12 we cannot see into yet
+        return [ Identity(p, e) for p,e in sorted(self.entries.items()) if e['has_key'] and (e['format'] == 'p12' or e['fingerprint'] is not None) ]
+
+    def valid(self, now=None):
+        return [ i for i in self.identities() if i.is_valid(now) ]
+
+    def expiring(self, days, now=None):
+        return [ i for i in self.identities() if i.expires_within(days, now) ]
+
+    def find(self, fingerprint=None, subject=None):
+        return [ i for i in self.identities() if (fingerprint is None or i.fingerprint == fingerprint) and (subject is None or i.subject == subject) ]
+
+    def _scan(self, path, password):
+        try:
+            if os.path.splitext(path)[1].lower() == '.pem':
+                return _scan_pem(path)
+            else:
+                return _scan_p12(path, password)
+        except (OpenSSL.crypto.Error, UnsupportedAlgorithm, IOError, OSError, ValueError):
+            # unreadable or not really a certificate, remember that so it is not decoded again
+            entry = { 'format': 'unknown', 'has_key': False, 'encrypted': False }
+            entry.update(_blank_details())
+            return entry
+
+def pick_identity(identities):
+    options = { str(i+1):identities[i] for i in range(len(identities)) }
+    selected = None
+
+    while selected is None:
+        print('Available PKI identities are:')
+
+        for k in sorted(list(options.keys()), key=int):
+            print('{0}) {1}'.format(k, options[k].describe()))
+
+        num = input23('Which identity do you want to use: ').strip()
+
+        if num in options:
+            selected = options[num]
+        else:
+            print('Invalid selection...')
+
+    return selected
@@ -1,6 +1,7 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
 from .exceptions import PyPKI2ConfigException
+from .profiles import new_ssl_context
 from .pem import _write_pem_with_password, _write_temp_pem
 from .utils import confirm_password, get_cert_path, get_password, return_password
 
@@ -65,9 +66,13 @@ class P12Loader(object):
             self.config.set('p12', { 'path': self.filename })
             self.ready = True
 
-    def new_context(self, protocol=ssl.PROTOCOL_SSLv23):
-        p12 = _load_p12(self.filename, self.password)
-        c = ssl.SSLContext(protocol)
+    def load_key(self):
+        return _load_p12(self.filename, self.password)
+
+    def new_context(self, protocol=ssl.PROTOCOL_SSLv23, key=None):
+        # key is an already decoded .p12 from load_key(), to avoid decoding it twice
+        p12 = key if key is not None else self.load_key()
+        c = new_ssl_context(protocol)
         f = NamedTemporaryFile(delete=False)
         _write_pem_with_password(p12, f, self.password)
         f.close()
@@ -81,5 +86,5 @@ class P12Loader(object):
         return c
 
     def dump_key(self, file_obj):
-        p12 = _load_p12(self.filename, self.password)
+        p12 = self.load_key()
         _write_temp_pem(p12, file_obj)
@@ -1,6 +1,7 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
 from .exceptions import PyPKI2ConfigException
+from .profiles import new_ssl_context
 from .utils import confirm_password, get_cert_path, get_password, make_date_str, return_password
 
 from functools import partial
@@ -38,12 +39,119 @@ def _write_pem(pkey, file_obj, password=None):
     file_obj.write(pem_cert_data)
     file_obj.flush()
 
+_BEGIN = b'-----BEGIN '
+_END = b'-----END '
+_DASHES = b'-----'
+
+# longest run of text without a newline kept while looking for a marker
+_MAX_LINE = 65536
+
+_CERTIFICATE_LABELS = ('CERTIFICATE', 'TRUSTED CERTIFICATE', 'X509 CERTIFICATE')
+_CHAIN_LABELS = ('PKCS7', 'CERTIFICATE CHAIN')
+
+class PEMObject(object):
+    def __init__(self, label, start, begin, end, attributes, data):
+        self.label = label            # text between BEGIN and the dashes, eg. 'CERTIFICATE'
+        self.start = start            # byte offset of the Bag Attributes preamble, or of the BEGIN line without one
+        self.begin = begin            # byte offset of the BEGIN line
+        self.end = end                # byte offset just past the END line
+        self.attributes = attributes  # Bag Attributes preamble as bytes, empty without one
+        self.data = data              # BEGIN line through END line as bytes
+
+    @property
+    def is_key(self):
+        return self.label.endswith('PRIVATE KEY')
+
+    @property
+    def is_encrypted(self):
+        return self.label == 'ENCRYPTED PRIVATE KEY' or b'Proc-Type: 4,ENCRYPTED' in self.data
+
+    @property
+    def is_certificate(self):
+        return self.label in _CERTIFICATE_LABELS
+
+    @property
+    def is_chain(self):
+        return self.label in _CHAIN_LABELS
+
+    @property
+    def is_crl(self):
+        return self.label == 'X509 CRL'
+
+def _line_start(buf, idx, floor):
+    return max(buf.rfind(b'\n', floor, idx) + 1, floor)
+
+def _line_end(buf, idx):
+    nl = buf.find(b'\n', idx)
+    return -1 if nl < 0 else nl + 1
+
+def iter_pem_objects(file_obj, chunk_size=65536):
+    '''
+    Makes one pass over a binary file object and yields a PEMObject for every
+    BEGIN/END block in it.  The file is read in chunks and searched with
+    bytes.find(), so only the current object and the text in front of it are
+    held in memory.  A "Bag Attributes" header in front of a BEGIN line is
+    kept as that object's attributes.
+    '''
+    buf = b''
+    base = 0    # file offset of buf[0]
+    pos = 0     # everything in buf before pos has been consumed
+    eof = False
+
+    while True:
+        begin = buf.find(_BEGIN, pos)
+        header_end = -1 if begin < 0 else _line_end(buf, begin)
+        end = -1 if header_end < 0 else buf.find(_END, header_end)
+        footer_end = -1 if end < 0 else _line_end(buf, end)
+
+        if footer_end < 0 and eof and end >= 0:
+            footer_end = len(buf)
+
+        if footer_end < 0:
+            if eof:
+                return
+
+            if begin < 0:
+                # nothing started yet, so only keep a Bag Attributes header or the unfinished last line
+                bag = buf.rfind(b'Bag Attributes', pos)
+                keep = _line_start(buf, bag if bag >= 0 else len(buf), pos)
+
+                if bag < 0 and len(buf) - keep > _MAX_LINE:
+                    keep = max(pos, len(buf) - len(b'Bag Attributes'))
+            else:
+                keep = pos
+
+            base += keep
+            buf = buf[keep:]
+            pos = 0
+            chunk = file_obj.read(chunk_size)
+
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+
+            continue
+
+        begin = _line_start(buf, begin, pos)
+        bag = buf.rfind(b'Bag Attributes', pos, begin)
+        start = begin if bag < 0 else _line_start(buf, bag, pos)
+        label = buf[begin:header_end].strip()[len(_BEGIN):-len(_DASHES)].decode('ascii', 'replace')
+        yield PEMObject(label, base+start, base+begin, base+footer_end, buf[start:begin], buf[begin:footer_end])
+        pos = footer_end
+
+def parse_pem_bundle(filename):
+    with open(filename, 'rb') as f:
+        return list(iter_pem_objects(f))
+
 class CALoader(object):
     def __init__(self, config):
         self.name = 'PEM Certificate Authority'
         self.config = config
         self.filename = None
         self.ready = False
+        self._certificates = None
+        self._certificates_stamp = None
 
     def is_configured(self):
         if self.config.has('ca') and len(self.config.get('ca')) > 0 and os.path.exists(self.config.get('ca')):
@@ -55,11 +163,29 @@ class CALoader(object):
         if self.is_configured():
             self.filename = self.config.get('ca')
         else:
-            self.filename = get_cert_path('Path to your certificate authority (CA) file: ')
+            while True:
+                self.filename = get_cert_path('Path to your certificate authority (CA) file: ')
+
+                if len(self.certificates()) > 0:
+                    break
+                else:
+                    print('No certificates found in {0}.  Please try again.'.format(self.filename))
+
             self.config.set('ca', self.filename)
 
         self.ready = True
 
+    def certificates(self):
+        # the bundle is only parsed again when the file changes
+        st = os.stat(self.filename)
+        stamp = (self.filename, st.st_mtime, st.st_size)
+
+        if self._certificates_stamp != stamp:
+            self._certificates = [ o for o in parse_pem_bundle(self.filename) if o.is_certificate ]
+            self._certificates_stamp = stamp
+
+        return self._certificates
+
 def _load_pem(filename, password):
     with open(filename, 'rb') as f:
         pem = OpenSSL.crypto.load_privatekey(OpenSSL.crypto.FILETYPE_PEM, f.read(), password)
@@ -109,13 +235,17 @@ class PEMLoader(object):
             self.config.set('pem', { 'path': self.filename })
             self.ready = True
 
-    def new_context(self, protocol=ssl.PROTOCOL_SSLv23):
-        c = ssl.SSLContext(protocol)
+    def load_key(self):
+        return _load_pem(self.filename, self.password)
+
+    def new_context(self, protocol=ssl.PROTOCOL_SSLv23, key=None):
+        # load_cert_chain reads the key straight from the file, so a decoded key is not needed
+        c = new_ssl_context(protocol)
         c.load_cert_chain(self.filename, password=self.password)
         return c
 
     def dump_key(self, file_obj):
-        pem = _load_pem(self.filename, self.password)
+        pem = self.load_key()
         _write_temp_pem(pem, file_obj)
 
     def _combine_pem_files(self, path_info):
@@ -143,46 +273,11 @@ class PEMLoader(object):
 
     def _get_pem_paths(self):
         keyFile = get_cert_path('Path to your .pem digital signature (DS) key file: ')
-        keyData = self._extract_pem_key(keyFile)
-        certData = self._extract_pem_cert(keyFile)
+        objects = parse_pem_bundle(keyFile)
         info = { 'path': keyFile }
 
-        if certData is None:
+        if not any(o.is_certificate for o in objects):
             certFile = get_cert_path('Path to your .pem digital signature (DS) certificate file: ')
             info['cert'] = certFile
 
         return info
-
-    def _extract_pem_cert(self, filename):
-        return self._extract_pem(filename, 'Bag Attributes', '-----END CERTIFICATE-----')
-
-    def _extract_pem_key(self, filename):
-        return self._extract_pem(filename, 'Bag Attributes', '-----END ENCRYPTED PRIVATE KEY-----')
-
-    def _extract_pem(self, filename, beginStr, endStr):
-        ret = None
-
-        with open(filename, 'r') as f:
-            lines = list(f.readlines())
-            begin = None
-            end = None
-
-            for i, x in enumerate(lines):
-                if endStr in x:
-                    end = i
-                    break
-
-            if end is not None:
-                for i in range(end, -1, -1):
-                    if beginStr in lines[i]:
-                        begin = i
-                        break
-
-                if begin is not None:
-                    ret = ''.join(lines[begin:end+1])
-                else:
-                    ret = None
-            else:
-                ret = None
-
-        return ret
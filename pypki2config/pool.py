@@ -0,0 +1,264 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .compression import ACCEPT_ENCODING, DecodingReader, supported
+from .exceptions import PyPKI2ConfigException
+
+from collections import deque
+from threading import Lock
+
+import errno
+import socket
+import sys
+
+if sys.version_info.major == 3:
+    from http.client import BadStatusLine, HTTPSConnection
+    from urllib.parse import urlsplit
+elif sys.version_info.major == 2:
+    from httplib import BadStatusLine, HTTPSConnection
+    from urlparse import urlsplit
+else:
+    raise PyPKI2ConfigException('Version {0}.{1} is an unknown version of Python.'.format(sys.version_info.major, sys.version_info.minor))
+
+# a reused connection failing with one of these was closed by the server while it sat in the
+# pool, before any of the response arrived; timeouts and TLS errors are not retried
+_STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+# describe the compressed body, so they are hidden once PooledResponse decodes it
+_ENCODED_HEADERS = ('content-encoding', 'content-length')
+
+# only these are sent a second time after a stale connection, unless the caller asks for a retry
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE')
+
+def _is_stale(e):
+    if isinstance(e, BadStatusLine):
+        return True
+
+    return isinstance(e, socket.error) and not isinstance(e, socket.timeout) and getattr(e, 'errno', None) in _STALE_ERRNOS
+
+def split_url(url):
+    parts = urlsplit(url)
+
+    if parts.scheme != 'https':
+        raise PyPKI2ConfigException('Only https URLs can be fetched with PKI.  Got {0}'.format(url))
+
+    path = parts.path or '/'
+
+    if parts.query:
+        path = path + '?' + parts.query
+
+    return parts.hostname, parts.port or 443, path
+
+class PoolStats(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'connections_discarded': 0,
+            'connections_preopened': 0,
+            'responses_compressed': 0,
+            'bytes_received': 0,
+            'bytes_decoded': 0,
+            'decompress_seconds': 0.0,
+        }
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+class PooledResponse(object):
+    def __init__(self, pool, conn, resp, reused=False):
+        self.pool = pool
+        self.conn = conn
+        self.resp = resp
+        self.reused = reused  # False when this request had to open (and handshake) a new connection
+        self.status = resp.status
+        self.reason = resp.reason
+        self.encoding = resp.getheader('content-encoding')
+
+        if supported(self.encoding):
+            self.decoder = DecodingReader(resp.read, self.encoding, stats=pool.stats)
+            pool.stats.incr('responses_compressed')
+        else:
+            self.decoder = None
+
+    def getheader(self, name, default=None):
+        if self.decoder is not None and name.lower() in _ENCODED_HEADERS:
+            return default
+
+        return self.resp.getheader(name, default)
+
+    def getheaders(self):
+        if self.decoder is not None:
+            return [ (k, v) for k,v in self.resp.getheaders() if k.lower() not in _ENCODED_HEADERS ]
+
+        return self.resp.getheaders()
+
+    def read(self, amt=None):
+        if self.decoder is not None:
+            data = self.decoder.read(amt)
+
+            # drain anything after the end of the compressed stream so the connection can be reused
+            if self.decoder.done and not self.resp.isclosed():
+                self.resp.read()
+        elif amt is None:
+            data = self.resp.read()
+            self.pool.stats.incr('bytes_received', len(data))
+        else:
+            data = self.resp.read(amt)
+            self.pool.stats.incr('bytes_received', len(data))
+
+        if self.resp.isclosed():
+            self._release()
+
+        return data
+
+    def stream(self, chunk_size=16384):
+        while True:
+            data = self.read(chunk_size)
+
+            if not data:
+                break
+
+            yield data
+
+    def close(self):
+        # a partially read body leaves the connection in an unknown state
+        if self.conn is not None:
+            self.pool.discard(self.conn)
+            self.conn = None
+
+        self.resp.close()
+
+    def _release(self):
+        if self.conn is not None:
+            if self.resp.will_close:
+                self.pool.discard(self.conn)
+            else:
+                self.pool.put(self.conn)
+
+            self.conn = None
+
+class ConnectionPool(object):
+    def __init__(self, loader, max_idle_per_host=4, timeout=None, compress=True):
+        self.loader = loader
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.compress = compress
+        self.stats = PoolStats()
+        self.lock = Lock()
+        self.idle = {}
+
+    def context(self, host=None):
+        # connections share the Loader's context for their profile, so the key is only decoded once
+        return self.loader.shared_context(host=host)
+
+    def get(self, host, port):
+        with self.lock:
+            idle = self.idle.get((host, port))
+
+            if idle:
+                conn = idle.pop()
+            else:
+                conn = None
+
+        if conn is not None:
+            self.stats.incr('connections_reused')
+            return conn, True
+
+        conn = self._new_connection(host, port)
+        self.stats.incr('connections_created')
+        return conn, False
+
+    def put(self, conn):
+        key = (conn.host, conn.port)
+
+        with self.lock:
+            idle = self.idle.setdefault(key, deque())
+
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                conn = None
+
+        if conn is not None:
+            self.discard(conn)
+
+    def preconnect(self, host, port=443, count=1):
+        # opens and handshakes idle connections ahead of demand, up to count (and max_idle_per_host) per host
+        with self.lock:
+            wanted = min(count, self.max_idle_per_host) - len(self.idle.get((host, port), ()))
+
+        for i in range(wanted):
+            conn = self._new_connection(host, port)
+            conn.connect()
+            self.stats.incr('connections_created')
+            self.stats.incr('connections_preopened')
+            self.put(conn)
+
+        return max(wanted, 0)
+
+    def discard(self, conn):
+        self.stats.incr('connections_discarded')
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, retry=None):
+        host, port, path = split_url(url)
+        headers = dict(headers or {})
+
+        if self.compress and not any(k.lower() == 'accept-encoding' for k in headers):
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+
+        conn, reused = self.get(host, port)
+        self.stats.incr('requests')
+
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+        except Exception as e:
+            self.discard(conn)
+
+            if not (reused and retry and _is_stale(e)):
+                raise
+
+            # the server dropped the idle connection, so try once more on a fresh one
+            conn = self._new_connection(host, port)
+            reused = False
+            self.stats.incr('connections_created')
+
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except Exception:
+                self.discard(conn)
+                raise
+
+        return PooledResponse(self, conn, resp, reused=reused)
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _new_connection(self, host, port):
+        if self.timeout is None:
+            conn = HTTPSConnection(host, port, context=self.context(host))
+        else:
+            conn = HTTPSConnection(host, port, timeout=self.timeout, context=self.context(host))
+
+        return self.loader.wrap_connection(conn)
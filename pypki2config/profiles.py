@@ -0,0 +1,166 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import PyPKI2ConfigException
+
+from threading import Lock
+
+import socket
+import sys
+
+try:
+    import ssl
+except ImportError:
+    raise PyPKI2ConfigException('Cannot use pypki2.  This instance of Python was not compiled with SSL support.  Try installing openssl-devel and recompiling.')
+
+DEFAULT_PROFILE = 'default'
+
+# Settings applied on top of the SSLContext holding your PKI identity.
+#
+# default      Python's stock settings, which is what pypki2 has always used.
+# fast-modern  TLS 1.2 or 1.3 only.  TLS 1.3 needs one round trip less than
+#              1.2 for a full handshake.  Offering only P-256 means the key
+#              share in the ClientHello is one every TLS 1.3 server (including
+#              FIPS builds) accepts, so there is no HelloRetryRequest round
+#              trip.  ECDHE with AES-GCM/ChaCha20 keeps RSA key exchange and
+#              CBC suites out, and sessions are resumed where the server allows.
+# compat       Anything down to TLS 1.0 with OpenSSL's default cipher list at
+#              security level 0 (needed for TLS 1.0/1.1 with OpenSSL 3), for
+#              old servers that fail with the stock settings.  Sessions are
+#              still resumed, since that is the cheapest handshake there is.
+PROFILES = {
+    'default': {},
+    'fast-modern': {
+        'minimum_version': 'TLSv1_2',
+        'maximum_version': 'TLSv1_3',
+        'ecdh_curve': 'prime256v1',
+        'ciphers': 'ECDHE+AESGCM:ECDHE+CHACHA20',
+        'session_tickets': True,
+        'resume_sessions': True,
+        'alpn': [ 'http/1.1' ],
+    },
+    'compat': {
+        'minimum_version': 'TLSv1',
+        'ciphers': 'DEFAULT:@SECLEVEL=0' if ssl.OPENSSL_VERSION_INFO >= (1, 1, 0) else 'DEFAULT',
+        'session_tickets': True,
+        'resume_sessions': True,
+    },
+}
+
+# only these protocols let the version range be narrowed with minimum_version/maximum_version
+_FLEXIBLE_PROTOCOLS = tuple(getattr(ssl, name) for name in ('PROTOCOL_SSLv23', 'PROTOCOL_TLS', 'PROTOCOL_TLS_CLIENT') if hasattr(ssl, name))
+
+# used instead of minimum_version/maximum_version before Python 3.7
+_NO_VERSION_OPTIONS = [ ('TLSv1', 'OP_NO_TLSv1'), ('TLSv1_1', 'OP_NO_TLSv1_1'), ('TLSv1_2', 'OP_NO_TLSv1_2'), ('TLSv1_3', 'OP_NO_TLSv1_3') ]
+
+def get_profile(name):
+    if name not in PROFILES:
+        raise PyPKI2ConfigException('Unknown TLS profile {0}.  Available profiles are: {1}'.format(name, ', '.join(sorted(PROFILES.keys()))))
+
+    return PROFILES[name]
+
+class SessionCache(object):
+    # the most recent TLS session for each (host, port); sessions only work with the context that made them
+    def __init__(self):
+        self.lock = Lock()
+        self.sessions = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.sessions.get(key)
+
+    def put(self, key, session):
+        if session is not None:
+            with self.lock:
+                self.sessions[key] = session
+
+if sys.version_info >= (3, 7):
+    class _ResumableSocket(ssl.SSLSocket):
+        def _real_close(self):
+            # TLS 1.3 tickets arrive after the handshake, so keep the newest session when the socket goes away
+            cache = getattr(self.context, 'session_cache', None)
+            key = getattr(self, '_pypki2_session_key', None)
+
+            if cache is not None and key is not None and self._sslobj is not None:
+                try:
+                    cache.put(key, self.session)
+                except (ValueError, ssl.SSLError):
+                    pass
+
+            super(_ResumableSocket, self)._real_close()
+
+class PKIContext(ssl.SSLContext):
+    '''
+    An SSLContext that offers the previous session for the same host when a
+    profile turns on session resumption.
+    '''
+    session_cache = None
+
+    if sys.version_info >= (3, 7):
+        sslsocket_class = _ResumableSocket
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        cache = self.session_cache
+        key = None
+
+        if cache is not None and kwargs.get('server_hostname') is not None and kwargs.get('session') is None:
+            try:
+                key = (kwargs['server_hostname'], sock.getpeername()[1])
+            except socket.error:
+                key = None
+
+            if key is not None:
+                kwargs['session'] = cache.get(key)
+
+        wrapped = ssl.SSLContext.wrap_socket(self, sock, *args, **kwargs)
+
+        if key is not None:
+            wrapped._pypki2_session_key = key
+            cache.put(key, wrapped.session)
+
+        return wrapped
+
+def new_ssl_context(protocol):
+    # session resumption through PKIContext needs the session argument added in Python 3.6
+    if sys.version_info >= (3, 6):
+        return PKIContext(protocol)
+    else:
+        return ssl.SSLContext(protocol)
+
+def apply_profile(c, name):
+    profile = get_profile(name)
+
+    if c.protocol in _FLEXIBLE_PROTOCOLS:
+        if hasattr(c, 'minimum_version'):
+            if 'minimum_version' in profile:
+                c.minimum_version = getattr(ssl.TLSVersion, profile['minimum_version'])
+
+            if 'maximum_version' in profile:
+                c.maximum_version = getattr(ssl.TLSVersion, profile['maximum_version'])
+        else:
+            names = [ n for n,o in _NO_VERSION_OPTIONS ]
+            low = names.index(profile['minimum_version']) if 'minimum_version' in profile else 0
+            high = names.index(profile['maximum_version']) if 'maximum_version' in profile else len(names) - 1
+
+            for i, (n, o) in enumerate(_NO_VERSION_OPTIONS):
+                if (i < low or i > high) and hasattr(ssl, o):
+                    c.options |= getattr(ssl, o)
+
+    if 'ecdh_curve' in profile:
+        c.set_ecdh_curve(profile['ecdh_curve'])
+
+    if 'ciphers' in profile:
+        c.set_ciphers(profile['ciphers'])
+
+    if 'session_tickets' in profile and hasattr(ssl, 'OP_NO_TICKET'):
+        if profile['session_tickets']:
+            c.options &= ~ssl.OP_NO_TICKET
+        else:
+            c.options |= ssl.OP_NO_TICKET
+
+    if 'alpn' in profile and getattr(ssl, 'HAS_ALPN', False):
+        c.set_alpn_protocols(profile['alpn'])
+
+    if profile.get('resume_sessions') and isinstance(c, PKIContext):
+        c.session_cache = SessionCache()
+
+    return c
@@ -0,0 +1,116 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from threading import Lock
+
+import socket
+import time
+
+_GLOBAL_DEFAULT_TIMEOUT = getattr(socket, '_GLOBAL_DEFAULT_TIMEOUT', object())
+
+def parse_host(value, default_port=443):
+    # "host", "host:port" or "[v6 address]:port" from .mypki, lowercased like urlsplit().hostname
+    if value.startswith('['):
+        host, sep, rest = value[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    elif value.count(':') == 1:
+        host, sep, port = value.partition(':')
+    else:
+        host, port = value, ''
+
+    return host.lower(), int(port) if port else default_port
+
+class ResolverCache(object):
+    '''
+    Remembers getaddrinfo() results for ttl seconds so repeated connections
+    to the same host skip DNS.  The system resolver does not report record
+    TTLs, so every entry gets the same lifetime.  An entry is dropped early
+    when none of its addresses accept a connection, in case the host moved.
+    '''
+    def __init__(self, ttl=60.0, max_entries=256, clock=time.time, getaddrinfo=socket.getaddrinfo):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.resolve = getaddrinfo
+        self.lock = Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def getaddrinfo(self, host, port, family=0, socktype=socket.SOCK_STREAM):
+        key = (host, port, family, socktype)
+        now = self.clock()
+
+        with self.lock:
+            expires, addresses = self.entries.get(key, (0, None))
+
+            if addresses is not None and now < expires:
+                self.hits += 1
+                return addresses
+
+            self.misses += 1
+
+        # resolve outside the lock so one slow lookup does not hold up other hosts
+        addresses = self.resolve(host, port, family, socktype)
+
+        with self.lock:
+            if len(self.entries) >= self.max_entries and key not in self.entries:
+                self._evict(now)
+
+            self.entries[key] = (now + self.ttl, addresses)
+
+        return addresses
+
+    def forget(self, host, port=None):
+        with self.lock:
+            for key in [ k for k in self.entries if k[0] == host and (port is None or k[1] == port) ]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses }
+
+    def create_connection(self, address, timeout=_GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        # same contract as socket.create_connection, so it can stand in for HTTPConnection._create_connection
+        host, port = address
+        error = None
+
+        for family, socktype, proto, canonname, sockaddr in self.getaddrinfo(host, port):
+            sock = None
+
+            try:
+                sock = socket.socket(family, socktype, proto)
+
+                if timeout is not _GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+
+                if source_address:
+                    sock.bind(source_address)
+
+                sock.connect(sockaddr)
+                return sock
+            except socket.error as e:
+                error = e
+
+                if sock is not None:
+                    sock.close()
+
+        self.forget(host, port)
+
+        if error is not None:
+            raise error
+
+        raise socket.error('getaddrinfo returned an empty list for {0}'.format(host))
+
+    def _evict(self, now):
+        expired = [ k for k, (expires, addresses) in self.entries.items() if expires <= now ]
+
+        for key in expired:
+            del self.entries[key]
+
+        if len(self.entries) >= self.max_entries:
+            oldest = min(self.entries, key=lambda k: self.entries[k][0])
+            del self.entries[oldest]
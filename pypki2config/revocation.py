@@ -0,0 +1,304 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from .exceptions import CertificateRevokedException, PyPKI2ConfigException
+from .pem import iter_pem_objects
+from .utils import atomic_write, file_lock
+
+from threading import Lock
+
+import binascii
+import calendar
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import time
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+# Compiled indexes are a header followed by fixed-size records sorted as bytes.
+# Each record is the first 8 bytes of the SHA-1 of the issuer's DER-encoded
+# name followed by the serial number as a 20 byte big-endian two's complement
+# integer (the largest serial RFC 5280 allows, and DER integers are signed, so
+# the negative serials some CAs issue fit too), so a lookup is a binary search
+# over a memory-mapped file and never needs the CRLs to be parsed again.
+MAGIC = b'PKI2CRL1'
+HEADER = struct.Struct('>8sI')
+ISSUER_SIZE = 8
+SERIAL_SIZE = 20
+RECORD_SIZE = ISSUER_SIZE + SERIAL_SIZE
+SERIAL_MASK = (1 << (8 * SERIAL_SIZE)) - 1
+MANIFEST_VERSION = 2
+CRL_EXTENSIONS = ('.crl', '.pem', '.der')
+
+def _issuer_key(issuer_der):
+    return hashlib.sha1(issuer_der).digest()[:ISSUER_SIZE]
+
+def _serial_bytes(serial):
+    return binascii.unhexlify('{0:040x}'.format(serial & SERIAL_MASK))
+
+def make_record(issuer_der, serial):
+    return _issuer_key(issuer_der) + _serial_bytes(serial)
+
+def _load_crls(filename):
+    with open(filename, 'rb') as f:
+        pems = [ o.data for o in iter_pem_objects(f) if o.is_crl ]
+
+        if len(pems) > 0:
+            return [ x509.load_pem_x509_crl(data, default_backend()) for data in pems ]
+
+        f.seek(0)
+        return [ x509.load_der_x509_crl(f.read(), default_backend()) ]
+
+def _next_update(crl):
+    # seconds since the epoch, or None when the CRL does not say
+    when = getattr(crl, 'next_update_utc', None) or crl.next_update
+    return None if when is None else calendar.timegm(when.utctimetuple())
+
+def compile_crl_file(filename):
+    # returns the sorted records and the earliest nextUpdate of the CRLs in the file
+    try:
+        crls = _load_crls(filename)
+    except ValueError:
+        raise PyPKI2ConfigException('Unable to parse certificate revocation list {0}.  Is it a PEM or DER encoded CRL?'.format(filename))
+
+    records = set()
+    next_updates = [ t for t in (_next_update(crl) for crl in crls) if t is not None ]
+
+    for crl in crls:
+        issuer = _issuer_key(crl.issuer.public_bytes(default_backend()))
+
+        for revoked in crl:
+            records.add(issuer + _serial_bytes(revoked.serial_number))
+
+    return sorted(records), min(next_updates) if next_updates else None
+
+def write_records(filename, records):
+    # records must already be sorted
+    count = 0
+
+    with atomic_write(filename, mode='wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+
+        for record in records:
+            f.write(record)
+            count += 1
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count))
+
+    return count
+
+def read_records(filename, chunk_records=4096):
+    with open(filename, 'rb') as f:
+        magic, count = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC:
+            raise PyPKI2ConfigException('{0} is not a compiled revocation index.'.format(filename))
+
+        while True:
+            chunk = f.read(RECORD_SIZE * chunk_records)
+
+            if not chunk:
+                break
+
+            for i in range(0, len(chunk), RECORD_SIZE):
+                yield chunk[i:i+RECORD_SIZE]
+
+def _unique(records):
+    last = None
+
+    for record in records:
+        if record != last:
+            yield record
+            last = record
+
+class RevocationIndex(object):
+    '''
+    Revoked serial numbers from a set of CRL files, compiled once into a
+    sorted, memory-mapped index under cache_dir.  Each CRL file is compiled to
+    its own segment, so a refresh only re-parses the files whose mtime or size
+    changed and then merges the segments.  CRLs past their nextUpdate are
+    still used, with a warning, since an old list is better than none.
+    '''
+    def __init__(self, crl_paths, cache_dir, refresh_interval=60):
+        self.crl_paths = crl_paths
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.index_path = os.path.join(cache_dir, 'revoked.idx')
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.lock_path = os.path.join(cache_dir, 'revoked.lock')
+        self.lock = Lock()
+        self.map = None
+        self.mapped = None
+        self.count = 0
+        self.refreshed = None
+        self.next_updates = {}
+        self.warned = set()
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def __len__(self):
+        return self.count
+
+    def sources(self):
+        found = []
+
+        for p in self.crl_paths:
+            if os.path.isdir(p):
+                found.extend(os.path.join(p, name) for name in sorted(os.listdir(p)) if os.path.splitext(name)[1].lower() in CRL_EXTENSIONS)
+            elif os.path.exists(p):
+                found.append(p)
+            else:
+                raise PyPKI2ConfigException('Certificate revocation list {0} does not exist.'.format(p))
+
+        return [ os.path.abspath(p) for p in found ]
+
+    def refresh(self):
+        # the cache directory may be shared by other processes, so compiling and merging happen under a file lock too
+        with self.lock, file_lock(self.lock_path):
+            manifest = self._load_manifest()
+            sources = {}
+            changed = not os.path.exists(self.index_path)
+
+            for path in self.sources():
+                st = os.stat(path)
+                entry = manifest.get(path)
+                segment = os.path.join(self.cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + '.seg')
+
+                if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size or not os.path.exists(segment):
+                    records, next_update = compile_crl_file(path)
+                    count = write_records(segment, records)
+                    entry = { 'mtime': st.st_mtime, 'size': st.st_size, 'segment': segment, 'count': count, 'next_update': next_update }
+                    changed = True
+
+                sources[path] = entry
+
+            for path, entry in manifest.items():
+                if path not in sources:
+                    changed = True
+
+                    if os.path.exists(entry['segment']):
+                        os.unlink(entry['segment'])
+
+            if changed:
+                self._merge(sources)
+                self._store_manifest(sources)
+
+            # another process may have merged a new index since this one was mapped
+            if changed or self.map is None or self._index_stat() != self.mapped:
+                self._remap()
+
+            self.next_updates = dict((path, entry.get('next_update')) for path, entry in sources.items())
+            self.refreshed = time.time()
+
+        self._warn_stale()
+        return self
+
+    def stale(self, now=None):
+        # CRL files whose nextUpdate has passed, so revocations since then are missing
+        now = time.time() if now is None else now
+        return sorted(path for path, next_update in self.next_updates.items() if next_update is not None and next_update < now)
+
+    def _warn_stale(self):
+        for path in self.stale():
+            key = (path, self.next_updates[path])
+
+            if key not in self.warned:
+                self.warned.add(key)
+                print('Warning: certificate revocation list {0} was due to be replaced on {1}.  Revocations since then are not being checked.'.format(path, time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(self.next_updates[path]))))
+
+    def is_revoked(self, issuer_der, serial):
+        # a closed index maps itself again rather than answering from an empty map
+        if self.map is None or self.refreshed is None or time.time() - self.refreshed > self.refresh_interval:
+            self.refresh()
+
+        key = make_record(issuer_der, serial)
+
+        with self.lock:
+            buf = self.map
+            lo = 0
+            hi = self.count
+
+            while lo < hi:
+                mid = (lo + hi) // 2
+                offset = HEADER.size + mid * RECORD_SIZE
+
+                if buf[offset:offset+RECORD_SIZE] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+            offset = HEADER.size + lo * RECORD_SIZE
+            return lo < self.count and buf[offset:offset+RECORD_SIZE] == key
+
+    def check_certificate(self, der_cert):
+        cert = x509.load_der_x509_certificate(der_cert, default_backend())
+
+        if self.is_revoked(cert.issuer.public_bytes(default_backend()), cert.serial_number):
+            raise CertificateRevokedException('Certificate for {0} (serial {1:x}) has been revoked.'.format(cert.subject.rfc4514_string(), cert.serial_number))
+
+    def check_socket(self, sock):
+        # the handshake is already done, so this only costs a DER parse and a binary search
+        self.check_certificate(sock.getpeercert(binary_form=True))
+
+    def close(self):
+        with self.lock:
+            self._unmap()
+
+    def _merge(self, sources):
+        segments = [ read_records(entry['segment']) for entry in sources.values() ]
+
+        # Windows cannot replace a file that is still mapped
+        self._unmap()
+        write_records(self.index_path, _unique(heapq.merge(*segments)))
+
+    def _remap(self):
+        self._unmap()
+
+        with open(self.index_path, 'rb') as f:
+            magic, count = HEADER.unpack(f.read(HEADER.size))
+
+            if magic != MAGIC:
+                raise PyPKI2ConfigException('{0} is not a compiled revocation index.'.format(self.index_path))
+
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.count = count
+            self.mapped = self._stat_key(os.fstat(f.fileno()))
+
+    def _unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.mapped = None
+            self.count = 0
+
+    def _stat_key(self, st):
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _index_stat(self):
+        try:
+            return self._stat_key(os.stat(self.index_path))
+        except OSError:
+            return None
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    j = json.load(f)
+            except ValueError:
+                return {}
+
+            if j.get('version') == MANIFEST_VERSION:
+                return j.get('sources', {})
+
+        return {}
+
+    def _store_manifest(self, sources):
+        with atomic_write(self.manifest_path) as f:
+            json.dump({ 'version': MANIFEST_VERSION, 'sources': sources }, f)
@@ -1,14 +1,27 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
-from .exceptions import PyPKI2ConfigException
+from .exceptions import PasswordException, PyPKI2ConfigException
 
+from contextlib import contextmanager
 from datetime import datetime
 from getpass import getpass
+from tempfile import NamedTemporaryFile
 
 import OpenSSL.crypto
 import os
+import stat
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 def input23(prompt):
     if sys.version_info.major == 3:
         return input(prompt)
@@ -65,7 +78,7 @@ def confirm_password(input_function, load_function, attempts_allowed=0):
 
     while True:
         if attempts_allowed > 0 and attempt_count >= attempts_allowed:
-            raise PyPKI2ConfigException('Could not confirm password after {0} attempts'.format(attempt_count))
+            raise PasswordException('Could not confirm password after {0} attempts'.format(attempt_count))
 
         password = input_function()
         attempt_count += 1
@@ -108,3 +121,54 @@ def get_cert_path(prompt):
             continue
 
     return path
+
+def replace_file(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # Python 2 on Windows cannot rename over an existing file
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+
+        os.rename(src, dst)
+
+@contextmanager
+def atomic_write(filename, mode='w'):
+    # written to a temp file in the same directory, then renamed over filename so readers never see half a file;
+    # a symlinked filename (eg. a dotfile kept elsewhere) is resolved so the link itself survives
+    filename = os.path.realpath(filename)
+    f = NamedTemporaryFile(mode=mode, dir=os.path.dirname(filename), delete=False)
+
+    try:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+        if os.path.exists(filename):
+            os.chmod(f.name, stat.S_IMODE(os.stat(filename).st_mode))
+
+        replace_file(f.name, filename)
+    except Exception:
+        f.close()
+        os.unlink(f.name)
+        raise
+
+@contextmanager
+def file_lock(filename):
+    # advisory lock shared with other processes, held on a separate lock file
+    with open(filename, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -13,6 +13,6 @@ setup(
     packages=['pypki2', 'pypki2config', 'pypki2pip'],
     package_data={},
     python_requires='>=2.7.9, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, <4',
-    install_requires=['pyOpenSSL'],
+    install_requires=['pyOpenSSL', 'cryptography'],
     keywords=['pki','ssl','pem','pkcs12','p12','mypki','pip']
 )
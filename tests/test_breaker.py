@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import pypki2config.breaker
+import pypki2config.config
+import unittest
+
+KEY = ('service', 443)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class InterruptedConnection(object):
+    host, port = KEY
+
+    def connect(self):
+        raise KeyboardInterrupt()
+
+    def close(self):
+        pass
+
+class ConnectedConnection(object):
+    host, port = KEY
+    sock = None
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+class FailingIndex(object):
+    def __init__(self, error):
+        self.error = error
+
+    def check_socket(self, sock):
+        raise self.error
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = pypki2config.breaker.CircuitBreaker(failures=2, base_delay=2.0, max_delay=10.0, clock=self.clock)
+
+    def fail(self):
+        self.breaker.before_connect(KEY)
+        self.breaker.record_failure(KEY, Exception('handshake failed'))
+
+    def test_opens_after_threshold(self):
+        self.fail()
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.OPEN)
+
+        with self.assertRaises(pypki2config.exceptions.CircuitOpenException):
+            self.breaker.before_connect(KEY)
+
+    def test_single_trial_then_close(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 2.0
+        self.breaker.before_connect(KEY)
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.HALF_OPEN)
+
+        # only one trial at a time
+        with self.assertRaises(pypki2config.exceptions.CircuitOpenException):
+            self.breaker.before_connect(KEY)
+
+        self.breaker.record_success(KEY)
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.CLOSED)
+        self.breaker.before_connect(KEY)
+
+    def test_backoff_doubles_and_caps(self):
+        self.fail()
+        self.fail()
+        delays = []
+
+        for i in range(5):
+            retry_at = self.breaker.hosts[KEY].retry_at
+            delays.append(retry_at - self.clock.now)
+            self.clock.now = retry_at
+            self.fail()
+
+        self.assertEqual(delays, [ 2.0, 4.0, 8.0, 10.0, 10.0 ])
+
+    def test_check_does_not_claim_trial(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 2.0
+        self.breaker.check(KEY)
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.OPEN)
+
+    def test_abandoned_trial_expires(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 2.0
+        self.breaker.before_connect(KEY)
+
+        # the trial never reports back, so another is let through after one more delay
+        self.clock.now += 2.0
+        self.breaker.before_connect(KEY)
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.HALF_OPEN)
+
+    def test_interrupted_trial_released(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 2.0
+
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.breaker = self.breaker
+        loader.resolver = None
+        loader.revocation = None
+        loader.config = None
+        conn = loader.wrap_connection(InterruptedConnection())
+
+        with self.assertRaises(KeyboardInterrupt):
+            conn.connect()
+
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.OPEN)
+        self.breaker.before_connect(KEY)
+
+    def test_concurrent_failures_open_once(self):
+        for i in range(4):
+            self.breaker.before_connect(KEY)
+
+        for i in range(4):
+            self.breaker.record_failure(KEY, Exception('handshake failed'))
+
+        circuit = self.breaker.hosts[KEY]
+        self.assertEqual(circuit.opens, 1)
+        self.assertEqual(circuit.delay, 2.0)
+
+    def loader_with_index(self, index):
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.breaker = self.breaker
+        loader.resolver = None
+        loader.revocation = index
+        loader.config = None
+        return loader
+
+    def test_local_crl_error_not_a_host_failure(self):
+        error = pypki2config.exceptions.PyPKI2ConfigException('Unable to parse certificate revocation list')
+
+        for i in range(3):
+            conn = self.loader_with_index(FailingIndex(error)).wrap_connection(ConnectedConnection())
+
+            with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+                conn.connect()
+
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.CLOSED)
+        self.assertNotIn(KEY, self.breaker.hosts)
+
+    def test_revoked_certificate_is_a_host_failure(self):
+        error = pypki2config.exceptions.CertificateRevokedException('revoked')
+
+        for i in range(2):
+            conn = self.loader_with_index(FailingIndex(error)).wrap_connection(ConnectedConnection())
+
+            with self.assertRaises(pypki2config.exceptions.CertificateRevokedException):
+                conn.connect()
+
+        self.assertEqual(self.breaker.state(KEY), pypki2config.breaker.OPEN)
+
+    def test_config_values(self):
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.config = pypki2config.config.Configuration()
+
+        loader.config.set('circuit_breaker', True)
+        loader.configure_breaker()
+        self.assertEqual(loader.breaker.failures, 2)
+
+        loader.config.set('circuit_breaker', False)
+        loader.configure_breaker()
+        self.assertIsNone(loader.breaker)
+
+        loader.config.set('circuit_breaker', 3)
+
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            loader.configure_breaker()
+
+    def test_urllib_sees_socket_error(self):
+        import socket
+        self.assertTrue(issubclass(pypki2config.exceptions.CircuitOpenException, socket.error))
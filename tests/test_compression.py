@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from io import BytesIO
+
+import gzip
+import pypki2config.compression
+import pypki2config.pool
+import unittest
+import zlib
+
+BODY = b'{"results": [' + b','.join(b'{"id": %d, "name": "row"}' % i for i in range(5000)) + b']}'
+
+def gzip_bytes(data):
+    buf = BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def raw_deflate_bytes(data):
+    c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+class FakeResponse(object):
+    def __init__(self, data, encoding):
+        self.fp = BytesIO(data)
+        self.encoding = encoding
+        self.status = 200
+        self.reason = 'OK'
+        self.will_close = False
+        self.closed = False
+
+    def getheader(self, name, default=None):
+        return self.encoding if name.lower() == 'content-encoding' else default
+
+    def read(self, amt=None):
+        data = self.fp.read() if amt is None else self.fp.read(amt)
+
+        if not data or self.fp.tell() == len(self.fp.getvalue()):
+            self.closed = True
+
+        return data
+
+    def isclosed(self):
+        return self.closed
+
+    def getheaders(self):
+        return [ ('Content-Encoding', self.encoding), ('Content-Length', str(len(self.fp.getvalue()))), ('Content-Type', 'application/json') ]
+
+class FakePool(object):
+    def __init__(self):
+        self.stats = pypki2config.pool.PoolStats()
+        self.released = []
+
+    def put(self, conn):
+        self.released.append(conn)
+
+class DecodingReaderTest(unittest.TestCase):
+    def decode(self, data, encoding, amt=None):
+        stats = pypki2config.pool.PoolStats()
+        reader = pypki2config.compression.DecodingReader(BytesIO(data).read, encoding, stats=stats, chunk_size=1024)
+        out = []
+
+        while True:
+            chunk = reader.read(amt)
+
+            if amt is not None:
+                self.assertLessEqual(len(chunk), amt)
+
+            if not chunk:
+                break
+
+            out.append(chunk)
+
+        return b''.join(out), stats
+
+    def test_gzip(self):
+        data, stats = self.decode(gzip_bytes(BODY), 'gzip')
+        self.assertEqual(data, BODY)
+        self.assertEqual(stats.get('bytes_decoded'), len(BODY))
+        self.assertEqual(stats.get('bytes_received'), len(gzip_bytes(BODY)))
+        self.assertGreater(stats.get('decompress_seconds'), 0)
+
+    def test_deflate_bounded_reads(self):
+        data, stats = self.decode(zlib.compress(BODY), 'deflate', amt=100)
+        self.assertEqual(data, BODY)
+
+    def test_raw_deflate(self):
+        data, stats = self.decode(raw_deflate_bytes(BODY), 'Deflate')
+        self.assertEqual(data, BODY)
+
+    def test_truncated(self):
+        data = gzip_bytes(BODY)
+
+        with self.assertRaises(pypki2config.PyPKI2ConfigException):
+            self.decode(data[:len(data) // 2], 'gzip')
+
+    def test_empty_body(self):
+        data, stats = self.decode(b'', 'gzip')
+        self.assertEqual(data, b'')
+
+    def test_corrupt(self):
+        with self.assertRaises(pypki2config.PyPKI2ConfigException):
+            self.decode(b'not gzip at all', 'gzip')
+
+class PooledResponseTest(unittest.TestCase):
+    def test_streamed_and_released(self):
+        pool = FakePool()
+        resp = pypki2config.pool.PooledResponse(pool, 'conn', FakeResponse(gzip_bytes(BODY), 'gzip'))
+        self.assertEqual(b''.join(resp.stream(4096)), BODY)
+        self.assertEqual(pool.released, [ 'conn' ])
+        self.assertEqual(pool.stats.get('responses_compressed'), 1)
+
+    def test_encoded_headers_hidden(self):
+        resp = pypki2config.pool.PooledResponse(FakePool(), 'conn', FakeResponse(gzip_bytes(BODY), 'gzip'))
+        self.assertEqual(resp.getheaders(), [ ('Content-Type', 'application/json') ])
+        self.assertIsNone(resp.getheader('Content-Encoding'))
+        self.assertIsNone(resp.getheader('content-length'))
+
+    def test_identity(self):
+        pool = FakePool()
+        resp = pypki2config.pool.PooledResponse(pool, 'conn', FakeResponse(BODY, None))
+        self.assertEqual(resp.read(), BODY)
+        self.assertEqual(pool.stats.get('bytes_received'), len(BODY))
+        self.assertEqual(pool.released, [ 'conn' ])
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from threading import Thread
+
+import datetime
+import json
+import os
+import pypki2config.config
+import pypki2config.pem
+import shutil
+import tempfile
+import unittest
+
+def write_json(filename, data, bump=0):
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+
+    # make sure the change is visible even on filesystems with coarse mtimes
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + bump))
+
+class ConfigurationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, '.mypki')
+        write_json(self.path, { 'ca': '/ca.pem' })
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_instance(self):
+        a = pypki2config.config.load_configuration(self.path)
+        b = pypki2config.config.load_configuration(self.path)
+        self.assertIs(a, b)
+        self.assertEqual(a.get('ca'), '/ca.pem')
+
+    def test_external_change_notifies(self):
+        config = pypki2config.config.load_configuration(self.path)
+        seen = []
+        config.subscribe(lambda c, keys: seen.append(keys))
+
+        write_json(self.path, { 'ca': '/other.pem', 'p12': { 'path': '/me.p12' } }, bump=10)
+        pypki2config.config.load_configuration(self.path)
+        self.assertEqual(config.get('ca'), '/other.pem')
+        self.assertEqual(seen, [ set([ 'ca', 'p12' ]) ])
+
+        # nothing changed, so nothing is re-read or announced
+        pypki2config.config.load_configuration(self.path)
+        self.assertEqual(len(seen), 1)
+
+    def test_store_merges_and_replaces(self):
+        config = pypki2config.config.load_configuration(self.path)
+        config.set('p12', { 'path': '/me.p12' })
+
+        # another kernel adds a key after we loaded the file
+        write_json(self.path, { 'ca': '/ca.pem', 'cert_dir': '/certs' }, bump=10)
+        config.store(self.path)
+
+        with open(self.path) as f:
+            on_disk = json.load(f)
+
+        self.assertEqual(on_disk, { 'ca': '/ca.pem', 'cert_dir': '/certs', 'p12': { 'path': '/me.p12' } })
+        self.assertEqual(config.get('cert_dir'), '/certs')
+        self.assertFalse(config.changed)
+        self.assertEqual(sorted(os.listdir(self.directory)), [ '.mypki', '.mypki.lock' ])
+
+    def test_unsaved_changes_survive_refresh(self):
+        config = pypki2config.config.load_configuration(self.path)
+        config.set('ca', '/mine.pem')
+        write_json(self.path, { 'ca': '/theirs.pem', 'cert_dir': '/certs' }, bump=10)
+        config.refresh()
+        self.assertEqual(config.get('ca'), '/mine.pem')
+        self.assertEqual(config.get('cert_dir'), '/certs')
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_store_keeps_symlink(self):
+        real = os.path.join(self.directory, 'dotfiles-mypki')
+        os.rename(self.path, real)
+        os.symlink(real, self.path)
+
+        config = pypki2config.config.load_configuration(self.path)
+        config.set('cert_dir', '/certs')
+        config.store(self.path)
+
+        self.assertTrue(os.path.islink(self.path))
+
+        with open(real) as f:
+            self.assertEqual(json.load(f)['cert_dir'], '/certs')
+
+def write_identity(filename, password):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    name = x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, u'user') ])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(1).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=30)) \
+        .sign(key, hashes.SHA256(), default_backend())
+
+    with open(filename, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.BestAvailableEncryption(password)))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+class LoaderReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mypki_config')
+        self.ca = os.path.join(self.directory, 'ca.pem')
+
+        with open(self.ca, 'wb') as f:
+            f.write(write_identity(os.path.join(self.directory, 'first.pem'), b'secret'))
+
+        write_identity(os.path.join(self.directory, 'second.pem'), b'secret')
+        write_identity(os.path.join(self.directory, 'other.pem'), b'different')
+        write_json(self.path, { 'pem': { 'path': os.path.join(self.directory, 'first.pem') }, 'ca': self.ca })
+
+        self.saved_env = os.environ.get('MYPKI_CONFIG')
+        os.environ['MYPKI_CONFIG'] = self.directory
+        self.saved_get_password = pypki2config.pem.get_password
+
+    def tearDown(self):
+        pypki2config.pem.get_password = self.saved_get_password
+
+        if self.saved_env is None:
+            del os.environ['MYPKI_CONFIG']
+        else:
+            os.environ['MYPKI_CONFIG'] = self.saved_env
+
+        shutil.rmtree(self.directory)
+
+    def switch_identity(self, name, bump):
+        write_json(self.path, { 'pem': { 'path': os.path.join(self.directory, name) }, 'ca': self.ca }, bump=bump)
+
+    def test_reload_reuses_password(self):
+        loader = pypki2config.config.Loader()
+        loader.new_context(password='secret')
+
+        self.switch_identity('second.pem', 10)
+        loader.new_context()
+        self.assertTrue(loader.loader.filename.endswith('second.pem'))
+
+        # and from a worker thread, which must not prompt
+        self.switch_identity('first.pem', 20)
+        errors = []
+
+        def worker():
+            try:
+                loader.shared_context()
+            except Exception as e:
+                errors.append(e)
+
+        t = Thread(target=worker)
+        t.start()
+        t.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(loader.loader.filename.endswith('first.pem'))
+
+    def test_new_password_prompts_on_main_thread(self):
+        loader = pypki2config.config.Loader()
+        loader.new_context(password='secret')
+
+        prompts = []
+        pypki2config.pem.get_password = lambda filename: prompts.append(filename) or b'different'
+        self.switch_identity('other.pem', 10)
+        loader.new_context()
+        self.assertEqual(len(prompts), 1)
+        self.assertTrue(loader.loader.filename.endswith('other.pem'))
+
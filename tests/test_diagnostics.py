@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import datetime
+import json
+import os
+import pypki2config.diagnostics
+import pypki2config.profiles
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import unittest
+
+class SummaryTest(unittest.TestCase):
+    def test_percentiles(self):
+        values = [ float(i) for i in range(1, 101) ]
+        self.assertEqual(pypki2config.diagnostics.percentile(values, 50), 51.0)
+        self.assertEqual(pypki2config.diagnostics.percentile(values, 95), 95.0)
+        self.assertIsNone(pypki2config.diagnostics.percentile([], 50))
+
+    def test_table_has_every_phase(self):
+        samples = [ { 'tcp_connect': 0.001, 'tls_handshake': 0.01, 'first_byte': 0.002, 'total': 0.013, 'session_reused': i > 0 } for i in range(4) ]
+        report = {
+            'url': 'https://example/',
+            'setup': { 'config_load': 0.01, 'key_decode': 0.1, 'context_build': 0.02, 'ca_load': 0.003 },
+            'sequential': {
+                'requests': 4,
+                'phases': pypki2config.diagnostics.summarize(samples, pypki2config.diagnostics.REQUEST_PHASES),
+                'session_resumption_rate': 0.75,
+                'protocol': 'TLSv1.3',
+                'cipher': 'TLS_AES_256_GCM_SHA384',
+            },
+        }
+        table = pypki2config.diagnostics.format_table(report)
+
+        for phase in pypki2config.diagnostics.SETUP_PHASES + pypki2config.diagnostics.REQUEST_PHASES:
+            self.assertIn(phase, table)
+
+        self.assertIn('session resumption rate: 75%', table)
+
+class FakeLoader(object):
+    def __init__(self, config_path):
+        self.config_path = config_path
+
+    def prepare_loader(self, password=None):
+        raise AssertionError('should have failed before loading anything')
+
+class NoPromptTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mypki_config')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def setup_with(self, config):
+        with open(self.path, 'w') as f:
+            json.dump(config, f)
+
+        pypki2config.diagnostics.measure_setup(FakeLoader(self.path), prompt=False)
+
+    def test_missing_identity(self):
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            self.setup_with({ 'ca': self.path })
+
+    def test_missing_ca(self):
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            self.setup_with({ 'p12': { 'path': '/me.p12' }, 'ca': os.path.join(self.directory, 'missing.pem') })
+
+def write_server_identity(directory):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    name = x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, u'localhost') ])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(1).not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(key, hashes.SHA256(), default_backend())
+    filename = os.path.join(directory, 'server.pem')
+
+    with open(filename, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    return filename
+
+class TinyServer(threading.Thread):
+    # answers every connection with a short HTTP response and resumes TLS sessions
+    def __init__(self, identity):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(identity)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except (OSError, socket.error):
+                return
+
+            try:
+                tls = self.context.wrap_socket(sock, server_side=True)
+                tls.recv(65536)
+                tls.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+                tls.close()
+            except (OSError, socket.error, ssl.SSLError):
+                sock.close()
+
+    def stop(self):
+        self.listener.close()
+
+@unittest.skipIf(sys.version_info < (3, 7), 'session resumption needs Python 3.7')
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = TinyServer(write_server_identity(self.directory))
+        self.server.start()
+        self.url = 'https://localhost:{0}/'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def context(self):
+        c = pypki2config.profiles.new_ssl_context(ssl.PROTOCOL_TLS_CLIENT)
+        c.check_hostname = False
+        c.verify_mode = ssl.CERT_NONE
+        return pypki2config.profiles.apply_profile(c, 'fast-modern')
+
+    def test_resume(self):
+        samples = pypki2config.diagnostics.run_sequential(self.context(), self.url, 4, timeout=5)
+        self.assertEqual([ s['session_reused'] for s in samples ], [ False, True, True, True ])
+
+    def test_no_resume(self):
+        samples = pypki2config.diagnostics.run_sequential(self.context(), self.url, 4, timeout=5, resume=False)
+        self.assertEqual([ s['session_reused'] for s in samples ], [ False, False, False, False ])
+
+class RequestErrorTest(unittest.TestCase):
+    def test_refused_requests_are_reported(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+
+        c = pypki2config.profiles.new_ssl_context(ssl.PROTOCOL_SSLv23)
+        samples = pypki2config.diagnostics.run_sequential(c, 'https://127.0.0.1:{0}/'.format(port), 3, timeout=5)
+        seq = pypki2config.diagnostics.summarize_sequential(samples)
+        self.assertEqual(seq['requests'], 3)
+        self.assertEqual(seq['errors'], 3)
+        self.assertIsNotNone(seq['error'])
+        self.assertIsNone(seq['session_resumption_rate'])
+        self.assertIsNone(seq['phases']['total']['median'])
+
+    def test_partial_failure(self):
+        ok = { 'tcp_connect': 0.001, 'tls_handshake': 0.01, 'first_byte': 0.002, 'total': 0.013, 'session_reused': False, 'protocol': 'TLSv1.3', 'cipher': 'TLS_AES_256_GCM_SHA384' }
+        seq = pypki2config.diagnostics.summarize_sequential([ ok, { 'error': 'connection reset' }, ok ])
+        self.assertEqual(seq['errors'], 1)
+        self.assertEqual(seq['phases']['total']['median'], 0.013)
+        self.assertEqual(seq['session_resumption_rate'], 0.0)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from threading import Lock
+
+import pypki2config
+import pypki2config.fetch
+import pypki2config.pool
+import socket
+import time
+import unittest
+
+class FakeResponse(object):
+    def __init__(self, status, data):
+        self.status = status
+        self.reason = 'OK'
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+    def getheaders(self):
+        return []
+
+class FakePool(object):
+    def __init__(self, delays):
+        self.delays = delays
+        self.lock = Lock()
+        self.active = {}
+        self.peak = {}
+
+    def context(self):
+        return None
+
+    def request(self, method, url, body=None, headers=None, retry=None):
+        host = url.split('/')[2]
+
+        with self.lock:
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+
+        time.sleep(self.delays.get(url, 0.01))
+
+        with self.lock:
+            self.active[host] -= 1
+
+        return FakeResponse(200, url)
+
+class HostLimiterTest(unittest.TestCase):
+    def test_grows_until_limit(self):
+        limiter = pypki2config.fetch.HostLimiter(4)
+
+        for i in range(10):
+            limiter.record(200, 0.1)
+
+        self.assertEqual(limiter.current, 4)
+
+    def test_throttle_halves(self):
+        limiter = pypki2config.fetch.HostLimiter(8)
+
+        for i in range(10):
+            limiter.record(200, 0.1)
+
+        limiter.record(503, 0.1)
+        self.assertEqual(limiter.current, 4)
+        limiter.record(429, 0.1)
+        self.assertEqual(limiter.current, 2)
+
+    def test_latency_spike_backs_off(self):
+        limiter = pypki2config.fetch.HostLimiter(8)
+
+        for i in range(4):
+            limiter.record(200, 0.1)
+
+        before = limiter.current
+        limiter.record(200, 5.0)
+        self.assertLess(limiter.current, before)
+
+    def test_new_connections_are_not_spikes(self):
+        limiter = pypki2config.fetch.HostLimiter(8)
+
+        # steady 50ms server, but every request that grows the limit pays a 200ms handshake
+        for i in range(40):
+            limiter.record(200, 0.05)
+            limiter.record(200, 0.25, reused=False)
+
+        self.assertEqual(limiter.current, 8)
+        self.assertFalse(limiter.congested)
+
+    def test_one_fast_response_does_not_pin_the_limit(self):
+        limiter = pypki2config.fetch.HostLimiter(8)
+        limiter.record(200, 0.005)
+
+        for i in range(200):
+            limiter.record(200, 0.05)
+
+        self.assertEqual(limiter.current, 8)
+
+    def test_mixed_latency_host(self):
+        limiter = pypki2config.fetch.HostLimiter(8)
+
+        # endpoints behind one name that answer in 5ms and 50ms
+        for i in range(100):
+            limiter.record(200, 0.005)
+            limiter.record(200, 0.05)
+
+        self.assertEqual(limiter.current, 8)
+
+class StaleConnection(object):
+    def __init__(self, host, port, error=None):
+        self.host = host
+        self.port = port
+        self.error = error
+        self.sent = []
+
+    def request(self, method, path, body=None, headers=None):
+        self.sent.append(method)
+
+    def getresponse(self):
+        if self.error is not None:
+            raise self.error
+
+        raise socket.error('no server here')
+
+    def close(self):
+        pass
+
+class RetryPool(pypki2config.pool.ConnectionPool):
+    def __init__(self, error):
+        pypki2config.pool.ConnectionPool.__init__(self, None)
+        self.put(StaleConnection('a', 443, error))
+        self.opened = []
+
+    def _new_connection(self, host, port):
+        conn = StaleConnection(host, port, pypki2config.pool.BadStatusLine('fresh'))
+        self.opened.append(conn)
+        return conn
+
+class StaleRetryTest(unittest.TestCase):
+    def sent(self, pool):
+        return sum([ c.sent for c in pool.opened ], [])
+
+    def test_get_retried_after_reset(self):
+        pool = RetryPool(socket.error(pypki2config.pool.errno.ECONNRESET, 'reset'))
+
+        with self.assertRaises(pypki2config.pool.BadStatusLine):
+            pool.request('GET', 'https://a/')
+
+        self.assertEqual(self.sent(pool), [ 'GET' ])
+
+    def test_post_not_resent(self):
+        pool = RetryPool(pypki2config.pool.BadStatusLine('closed'))
+
+        with self.assertRaises(pypki2config.pool.BadStatusLine):
+            pool.request('POST', 'https://a/', body='x')
+
+        self.assertEqual(pool.opened, [])
+
+    def test_post_opt_in(self):
+        pool = RetryPool(pypki2config.pool.BadStatusLine('closed'))
+
+        with self.assertRaises(pypki2config.pool.BadStatusLine):
+            pool.request('POST', 'https://a/', body='x', retry=True)
+
+        self.assertEqual(self.sent(pool), [ 'POST' ])
+
+    def test_timeout_not_retried(self):
+        pool = RetryPool(socket.timeout('timed out'))
+
+        with self.assertRaises(socket.timeout):
+            pool.request('GET', 'https://a/')
+
+        self.assertEqual(pool.opened, [])
+
+class FetchAllTest(unittest.TestCase):
+    def test_completion_order(self):
+        pool = FakePool({ 'https://a/slow': 0.3 })
+        urls = [ 'https://a/slow', 'https://b/fast' ]
+        results = list(pypki2config.fetch.fetch_all(pool, urls, max_per_host=2, max_total=2))
+        self.assertEqual([ r.data for r in results ], [ 'https://b/fast', 'https://a/slow' ])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_per_host_limit(self):
+        pool = FakePool({})
+        urls = [ 'https://a/{0}'.format(i) for i in range(40) ]
+        results = list(pypki2config.fetch.fetch_all(pool, urls, max_per_host=3, max_total=10))
+        self.assertEqual(len(results), 40)
+        self.assertLessEqual(pool.peak['a'], 3)
+
+    def test_rejects_plain_http(self):
+        with self.assertRaises(pypki2config.PyPKI2ConfigException):
+            list(pypki2config.fetch.fetch_all(FakePool({}), [ 'http://a/' ]))
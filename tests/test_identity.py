@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+import OpenSSL.crypto
+import os
+import pypki2config.config
+import pypki2config.identity
+import sys
+import shutil
+import tempfile
+import unittest
+
+def make_identity(filename, cn, days, with_key=True):
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+    cert = OpenSSL.crypto.X509()
+    cert.get_subject().CN = cn
+    cert.set_issuer(cert.get_subject())
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(-86400)
+    cert.gmtime_adj_notAfter(days * 86400)
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+
+    with open(filename, 'wb') as f:
+        if with_key:
+            f.write(OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, key))
+
+        f.write(OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert))
+
+def make_p12(filename, cn, days, password=None):
+    pem = filename + '.tmp'
+    make_identity(pem, cn, days)
+
+    with open(pem, 'rb') as f:
+        data = f.read()
+
+    os.unlink(pem)
+    key = OpenSSL.crypto.load_privatekey(OpenSSL.crypto.FILETYPE_PEM, data).to_cryptography_key()
+    cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, data).to_cryptography()
+    encryption = serialization.NoEncryption() if password is None else serialization.BestAvailableEncryption(password)
+
+    with open(filename, 'wb') as f:
+        f.write(pkcs12.serialize_key_and_certificates(cn.encode('utf-8'), key, cert, None, encryption))
+
+class IdentityIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        make_identity(os.path.join(self.directory, 'current.pem'), 'current', 365)
+        make_identity(os.path.join(self.directory, 'soon.pem'), 'soon', 3)
+        make_identity(os.path.join(self.directory, 'certonly.pem'), 'certonly', 365, with_key=False)
+
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('not a certificate')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_contents(self):
+        index = pypki2config.identity.IdentityIndex(self.directory).refresh()
+        subjects = sorted(i.subject for i in index.identities())
+        self.assertEqual(subjects, [ '/CN=current', '/CN=soon' ])
+
+        identity = index.find(subject='/CN=current')[0]
+        self.assertEqual(identity.key_type, 'RSA')
+        self.assertEqual(identity.key_bits, 2048)
+        self.assertFalse(identity.encrypted)
+        self.assertTrue(identity.is_valid())
+        self.assertEqual([ i.subject for i in index.expiring(14) ], [ '/CN=soon' ])
+
+    def test_persisted_and_invalidated_by_mtime(self):
+        pypki2config.identity.IdentityIndex(self.directory).refresh()
+        self.assertTrue(os.path.exists(os.path.join(self.directory, pypki2config.identity.INDEX_NAME)))
+
+        index = pypki2config.identity.IdentityIndex(self.directory)
+        self.assertEqual(len(index.identities()), 2)
+
+        path = os.path.join(self.directory, 'current.pem')
+        make_identity(path, 'replaced', 365)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        index.refresh()
+        self.assertEqual(index.find(subject='/CN=current'), [])
+        self.assertEqual(len(index.find(subject='/CN=replaced')), 1)
+
+    @unittest.skipUnless(hasattr(os, 'symlink') and sys.version_info.major == 3, 'needs symlinks and contextlib.redirect_stdout')
+    def test_expiry_warning_through_symlink(self):
+        from contextlib import redirect_stdout
+        from io import StringIO
+
+        link = os.path.join(tempfile.mkdtemp(), 'me.pem')
+        self.addCleanup(shutil.rmtree, os.path.dirname(link))
+        os.symlink(os.path.join(self.directory, 'soon.pem'), link)
+
+        class ConfiguredLoader(object):
+            filename = link
+            password = None
+
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.config = pypki2config.config.Configuration()
+        loader.config.set('cert_dir', self.directory + os.sep)
+        loader.loader = ConfiguredLoader()
+        out = StringIO()
+
+        with redirect_stdout(out):
+            loader.check_expiry()
+
+        self.assertIn('soon.pem expires', out.getvalue())
+
+    def test_removed_files_dropped(self):
+        index = pypki2config.identity.IdentityIndex(self.directory).refresh()
+        os.unlink(os.path.join(self.directory, 'soon.pem'))
+        index.refresh()
+        self.assertEqual([ i.subject for i in index.identities() ], [ '/CN=current' ])
+
+class P12IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.plain = os.path.join(self.directory, 'plain.p12')
+        self.locked = os.path.join(self.directory, 'locked.p12')
+        self.other = os.path.join(self.directory, 'other.p12')
+        make_p12(self.plain, 'plain', 365)
+        make_p12(self.locked, 'locked', 3, password=b'secret')
+        make_p12(self.other, 'other', 365, password=b'secret')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unencrypted_details(self):
+        index = pypki2config.identity.IdentityIndex(self.directory).refresh()
+        identity = index.find(subject='/CN=plain')[0]
+        self.assertFalse(identity.encrypted)
+        self.assertEqual(identity.key_type, 'RSA')
+        self.assertTrue(identity.is_valid())
+
+    def test_encrypted_details_after_password(self):
+        index = pypki2config.identity.IdentityIndex(self.directory).refresh()
+        self.assertEqual(len(index.identities()), 3)
+        self.assertEqual([ i.path for i in index.identities() if not i.known ], [ self.locked, self.other ])
+        self.assertEqual(index.expiring(14), [])
+
+        index.refresh(password='secret', path=self.locked)
+        self.assertEqual([ i.subject for i in index.expiring(14) ], [ '/CN=locked' ])
+
+        # the password belongs to locked.p12, so other.p12 is not opened with it
+        self.assertEqual([ i.path for i in index.identities() if not i.known ], [ self.other ])
+
+    def test_wrong_password(self):
+        index = pypki2config.identity.IdentityIndex(self.directory).refresh(password=b'wrong', path=self.locked)
+        self.assertTrue(index.find(subject='/CN=plain'))
+        self.assertIsNone(index.entries[self.locked]['not_after'])
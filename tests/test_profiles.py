@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import pypki2config.config
+import pypki2config.profiles
+import ssl
+import sys
+import unittest
+
+class ApplyProfileTest(unittest.TestCase):
+    def context(self, name):
+        c = pypki2config.profiles.new_ssl_context(ssl.PROTOCOL_SSLv23)
+        return pypki2config.profiles.apply_profile(c, name)
+
+    def test_default_leaves_context_alone(self):
+        stock = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        c = self.context('default')
+        self.assertEqual(c.options, stock.options)
+        self.assertIsNone(getattr(c, 'session_cache', None))
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'minimum_version needs Python 3.7')
+    def test_fast_modern(self):
+        c = self.context('fast-modern')
+        self.assertEqual(c.minimum_version, ssl.TLSVersion.TLSv1_2)
+        self.assertEqual(c.maximum_version, ssl.TLSVersion.TLSv1_3)
+        self.assertFalse(c.options & ssl.OP_NO_TICKET)
+        self.assertIsNotNone(c.session_cache)
+
+        for cipher in c.get_ciphers():
+            if cipher['protocol'] != 'TLSv1.3':
+                self.assertIn('ECDHE', cipher['name'])
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'minimum_version needs Python 3.7')
+    def test_compat(self):
+        c = self.context('compat')
+        self.assertEqual(c.minimum_version, ssl.TLSVersion.TLSv1)
+        self.assertIsNotNone(c.session_cache)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            self.context('fastest')
+
+class SessionCacheTest(unittest.TestCase):
+    def test_keeps_latest_session(self):
+        cache = pypki2config.profiles.SessionCache()
+        cache.put(('service', 443), 'first')
+        cache.put(('service', 443), 'second')
+        cache.put(('service', 443), None)
+        self.assertEqual(cache.get(('service', 443)), 'second')
+        self.assertIsNone(cache.get(('other', 443)))
+
+class ProfileForTest(unittest.TestCase):
+    def loader(self, tls):
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.config = pypki2config.config.Configuration()
+
+        if tls is not None:
+            loader.config.set('tls', tls)
+
+        return loader
+
+    def test_default_without_config(self):
+        self.assertEqual(self.loader(None).profile_for('service'), 'default')
+
+    def test_host_override(self):
+        loader = self.loader({ 'profile': 'fast-modern', 'hosts': { 'old.service': 'compat' } })
+        self.assertEqual(loader.profile_for('service'), 'fast-modern')
+        self.assertEqual(loader.profile_for('old.service'), 'compat')
+        self.assertEqual(loader.profile_for(None), 'fast-modern')
+
+    def test_host_override_ignores_case(self):
+        loader = self.loader({ 'hosts': { 'Old.Service': 'compat' } })
+        self.assertEqual(loader.profile_for('old.service'), 'compat')
+        self.assertEqual(loader.profile_for('OLD.SERVICE'), 'compat')
+
+    def test_unknown_profile_in_config(self):
+        loader = self.loader({ 'profile': 'fastest' })
+
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            loader.profile_for('service')
+
+if __name__ == '__main__':
+    unittest.main()
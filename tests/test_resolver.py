@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import pypki2config.config
+import pypki2config.pool
+import pypki2config.resolver
+import socket
+import unittest
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeDNS(object):
+    def __init__(self):
+        self.lookups = 0
+
+    def __call__(self, host, port, family=0, socktype=0):
+        self.lookups += 1
+        return socket.getaddrinfo('127.0.0.1', port, socket.AF_INET, socktype)
+
+class ResolverCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dns = FakeDNS()
+        self.cache = pypki2config.resolver.ResolverCache(ttl=60, max_entries=2, clock=self.clock, getaddrinfo=self.dns)
+
+    def test_cached_until_ttl(self):
+        first = self.cache.getaddrinfo('service', 443)
+        self.assertEqual(self.cache.getaddrinfo('service', 443), first)
+        self.assertEqual(self.dns.lookups, 1)
+
+        self.clock.now += 60
+        self.cache.getaddrinfo('service', 443)
+        self.assertEqual(self.dns.lookups, 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_bounded(self):
+        for host in ('a', 'b', 'c'):
+            self.clock.now += 1
+            self.cache.getaddrinfo(host, 443)
+
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+        # the oldest entry made room for the newest
+        self.cache.getaddrinfo('a', 443)
+        self.assertEqual(self.dns.lookups, 4)
+
+    def test_connect_and_forget_on_failure(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+
+        try:
+            sock = self.cache.create_connection(('service', port), 5)
+            self.assertEqual(sock.getpeername()[1], port)
+            sock.close()
+        finally:
+            listener.close()
+
+        with self.assertRaises(socket.error):
+            self.cache.create_connection(('service', port), 5)
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_parse_host(self):
+        self.assertEqual(pypki2config.resolver.parse_host('service'), ('service', 443))
+        self.assertEqual(pypki2config.resolver.parse_host('service:8443'), ('service', 8443))
+        self.assertEqual(pypki2config.resolver.parse_host('[::1]:8443'), ('::1', 8443))
+        self.assertEqual(pypki2config.resolver.parse_host('::1'), ('::1', 443))
+        self.assertEqual(pypki2config.resolver.parse_host('Service.Example:8443'), ('service.example', 8443))
+
+    def test_config_values(self):
+        loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        loader.config = pypki2config.config.Configuration()
+        loader.config.set('dns_cache', True)
+        loader.configure_resolver()
+        self.assertEqual(loader.resolver.ttl, 60.0)
+
+        loader.config.set('dns_cache', { 'ttl': 300 })
+        loader.configure_resolver()
+        self.assertEqual(loader.resolver.ttl, 300)
+
+        loader.config.set('dns_cache', 'yes')
+
+        with self.assertRaises(pypki2config.exceptions.PyPKI2ConfigException):
+            loader.configure_resolver()
+
+class FakeConnection(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+
+    def close(self):
+        pass
+
+class PreconnectPool(pypki2config.pool.ConnectionPool):
+    def _new_connection(self, host, port):
+        return FakeConnection(host, port)
+
+class PreconnectTest(unittest.TestCase):
+    def test_warm_connections_are_reused(self):
+        pool = PreconnectPool(None, max_idle_per_host=2)
+        self.assertEqual(pool.preconnect('service', 443, count=3), 2)
+        self.assertEqual(pool.preconnect('service', 443, count=3), 0)
+
+        conn, reused = pool.get('service', 443)
+        self.assertTrue(reused)
+        self.assertTrue(conn.connected)
+
+        stats = pool.stats.snapshot()
+        self.assertEqual(stats['connections_preopened'], 2)
+        self.assertEqual(stats['connections_reused'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import calendar
+import datetime
+import os
+import pypki2config.config
+import pypki2config.revocation
+import shutil
+import tempfile
+import threading
+import unittest
+
+def make_name(cn):
+    return x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, cn) ])
+
+def write_crl(filename, issuer, key, serials, encoding=serialization.Encoding.PEM):
+    now = datetime.datetime(2020, 1, 1)
+    builder = x509.CertificateRevocationListBuilder().issuer_name(issuer).last_update(now).next_update(now + datetime.timedelta(days=30))
+
+    for serial in serials:
+        builder = builder.add_revoked_certificate(x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(now).build(default_backend()))
+
+    crl = builder.sign(key, hashes.SHA256(), default_backend())
+
+    with open(filename, 'wb') as f:
+        f.write(crl.public_bytes(encoding))
+
+def make_cert(issuer, key, serial):
+    now = datetime.datetime(2020, 1, 1)
+    cert = x509.CertificateBuilder().subject_name(make_name('server')).issuer_name(issuer).public_key(key.public_key()) \
+        .serial_number(serial).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=30)) \
+        .sign(key, hashes.SHA256(), default_backend())
+    return cert.public_bytes(serialization.Encoding.DER)
+
+class RevocationIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crl_dir = os.path.join(self.directory, 'crls')
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        os.makedirs(self.crl_dir)
+        self.key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        self.issuer_a = make_name('ca-a')
+        self.issuer_b = make_name('ca-b')
+        write_crl(os.path.join(self.crl_dir, 'a.crl'), self.issuer_a, self.key, [ 5, 17, 2**150 ])
+        write_crl(os.path.join(self.crl_dir, 'b.der'), self.issuer_b, self.key, [ 3 ], encoding=serialization.Encoding.DER)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def index(self):
+        return pypki2config.revocation.RevocationIndex([ self.crl_dir ], self.cache_dir).refresh()
+
+    def test_lookup(self):
+        index = self.index()
+        a = self.issuer_a.public_bytes(default_backend())
+        b = self.issuer_b.public_bytes(default_backend())
+        self.assertEqual(len(index), 4)
+        self.assertTrue(index.is_revoked(a, 17))
+        self.assertTrue(index.is_revoked(a, 2**150))
+        self.assertTrue(index.is_revoked(b, 3))
+        self.assertFalse(index.is_revoked(a, 3))
+        self.assertFalse(index.is_revoked(b, 17))
+        self.assertFalse(index.is_revoked(a, 0))
+        index.close()
+
+    def test_check_certificate(self):
+        index = self.index()
+        index.check_certificate(make_cert(self.issuer_a, self.key, 6))
+
+        with self.assertRaises(pypki2config.exceptions.CertificateRevokedException):
+            index.check_certificate(make_cert(self.issuer_a, self.key, 5))
+
+        index.close()
+
+    def test_negative_serial(self):
+        a = self.issuer_a.public_bytes(default_backend())
+        self.assertNotEqual(pypki2config.revocation.make_record(a, -5), pypki2config.revocation.make_record(a, 5))
+        self.assertEqual(len(pypki2config.revocation.make_record(a, -5)), pypki2config.revocation.RECORD_SIZE)
+
+        index = self.index()
+        self.assertFalse(index.is_revoked(a, -17))
+        index.close()
+
+    def test_stale(self):
+        index = self.index()
+        self.assertEqual(len(index.stale()), 2)
+
+        # both CRLs say the next one is due on 2020-01-31
+        self.assertEqual(index.stale(now=calendar.timegm((2020, 1, 15, 0, 0, 0))), [])
+        index.close()
+
+    def test_incremental_refresh(self):
+        index = self.index()
+        b_segment = [ n for n in os.listdir(self.cache_dir) if n.endswith('.seg') ]
+        mtimes = { n:os.stat(os.path.join(self.cache_dir, n)).st_mtime for n in b_segment }
+
+        path = os.path.join(self.crl_dir, 'a.crl')
+        write_crl(path, self.issuer_a, self.key, [ 5, 99 ])
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        index.refresh()
+
+        a = self.issuer_a.public_bytes(default_backend())
+        self.assertTrue(index.is_revoked(a, 99))
+        self.assertFalse(index.is_revoked(a, 17))
+        self.assertEqual(len(index), 3)
+
+        # the untouched DER CRL keeps its compiled segment
+        unchanged = [ n for n in mtimes if os.stat(os.path.join(self.cache_dir, n)).st_mtime == mtimes[n] ]
+        self.assertEqual(len(unchanged), 1)
+        index.close()
+
+    def test_reopened_from_cache(self):
+        self.index().close()
+        index = pypki2config.revocation.RevocationIndex([ self.crl_dir ], self.cache_dir)
+        self.assertTrue(index.is_revoked(self.issuer_b.public_bytes(default_backend()), 3))
+        index.close()
+
+    def test_remaps_index_merged_elsewhere(self):
+        # two kernels sharing one cache directory
+        first = self.index()
+        second = self.index()
+
+        path = os.path.join(self.crl_dir, 'a.crl')
+        write_crl(path, self.issuer_a, self.key, [ 5, 99 ])
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        first.refresh()
+        second.refresh()
+
+        a = self.issuer_a.public_bytes(default_backend())
+        self.assertTrue(second.is_revoked(a, 99))
+        self.assertEqual(len(second), 3)
+        first.close()
+        second.close()
+
+    def test_closed_index_still_answers(self):
+        index = self.index()
+        index.close()
+        self.assertTrue(index.is_revoked(self.issuer_b.public_bytes(default_backend()), 3))
+        index.close()
+
+class LoaderRevocationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        crl_dir = os.path.join(self.directory, 'crls')
+        os.makedirs(crl_dir)
+        self.key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        self.issuer = make_name('ca-a')
+        write_crl(os.path.join(crl_dir, 'a.crl'), self.issuer, self.key, [ 5 ])
+
+        self.loader = pypki2config.config.Loader.__new__(pypki2config.config.Loader)
+        self.loader.lock = threading.RLock()
+        self.loader.config_path = os.path.join(self.directory, 'mypki_config')
+        self.loader.config = pypki2config.config.Configuration()
+        self.loader.config.set('crl', { 'paths': [ crl_dir ] })
+        self.loader.revocation = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_built_once(self):
+        found = []
+        threads = [ threading.Thread(target=lambda: found.append(self.loader.revocation_index())) for i in range(8) ]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(id(index) for index in found)), 1)
+        found[0].close()
+
+    def test_change_leaves_old_index_usable(self):
+        old = self.loader.revocation_index()
+        self.loader.config_changed(self.loader.config, [ 'crl' ])
+        self.assertIsNone(self.loader.revocation)
+
+        # a connection that picked up the old index before the change still sees revocations
+        self.assertTrue(old.is_revoked(self.issuer.public_bytes(default_backend()), 5))
+        old.close()